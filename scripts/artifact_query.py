@@ -16,6 +16,7 @@ Examples:
 """
 
 import argparse
+import functools
 import json
 import sqlite3
 from datetime import datetime
@@ -24,6 +25,7 @@ from typing import Optional
 import hashlib
 
 
+@functools.cache
 def get_db_path(custom_path: Optional[str] = None) -> Path:
     if custom_path:
         return Path(custom_path)
@@ -79,6 +81,62 @@ def get_ledger_for_session(conn: sqlite3.Connection, session_name: str) -> Optio
     return None
 
 
+def query_by_span_id(root_span_id: str, with_content: bool = False,
+                     db_path: Optional[str] = None,
+                     base_dir: Optional[Path] = None) -> Optional[dict]:
+    """Get the handoff (and its session ledger) for a Braintrust root_span_id.
+
+    With with_content, the handoff's file content is included under 'content'
+    and the session ledger under 'ledger'. Relative paths (database, handoff
+    and ledger files) resolve against base_dir, defaulting to the current
+    directory. Returns None if the database or handoff is not found.
+    """
+    base = Path(base_dir) if base_dir else Path()
+    db = base / get_db_path(db_path)
+    if not db.exists():
+        return None
+
+    conn = sqlite3.connect(db)
+    try:
+        handoff = get_handoff_by_span_id(conn, root_span_id)
+
+        if handoff and with_content and handoff.get('file_path'):
+            # Read full file content
+            file_path = base / handoff['file_path']
+            if file_path.exists():
+                handoff['content'] = file_path.read_text()
+
+            # Also get the ledger for this session
+            # Try session_name from handoff, or derive from folder path
+            session_name = handoff.get('session_name')
+            if not session_name:
+                # Extract from path: thoughts/shared/handoffs/{session_name}/...
+                parts = Path(handoff['file_path']).parts
+                if 'handoffs' in parts:
+                    idx = parts.index('handoffs')
+                    if idx + 1 < len(parts):
+                        session_name = parts[idx + 1]
+
+            if session_name:
+                # Try to find ledger file directly first
+                ledger_path = base / f"CONTINUITY_CLAUDE-{session_name}.md"
+                if ledger_path.exists():
+                    handoff['ledger'] = {
+                        'session_name': session_name,
+                        'file_path': str(ledger_path),
+                        'content': ledger_path.read_text()
+                    }
+                else:
+                    # Fall back to DB lookup
+                    ledger = get_ledger_for_session(conn, session_name)
+                    if ledger:
+                        handoff['ledger'] = ledger
+    finally:
+        conn.close()
+
+    return handoff
+
+
 def search_handoffs(conn: sqlite3.Connection, query: str, outcome: Optional[str] = None, limit: int = 5) -> list:
     """Search handoffs using FTS5 with BM25 ranking."""
     # Use rank column (faster than bm25() function for sorting)
@@ -105,6 +163,44 @@ def search_handoffs(conn: sqlite3.Connection, query: str, outcome: Optional[str]
     return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 
+def search_handoffs_multi(conn: sqlite3.Connection, query: str, buckets: dict) -> dict:
+    """Search handoffs for several outcomes in one statement.
+
+    buckets maps outcome -> limit; returns outcome -> results (best first),
+    same rows as calling search_handoffs once per outcome.
+    """
+    if not buckets:
+        return {}
+
+    # One limited subselect per outcome; SQLite needs the wrapping SELECT
+    # to allow ORDER BY/LIMIT inside a UNION ALL arm
+    selects = []
+    params = {"query": escape_fts5_query(query)}
+    for i, (outcome, limit) in enumerate(buckets.items()):
+        selects.append(f"""
+            SELECT * FROM (
+                SELECT h.id, h.session_name, h.task_number, h.task_summary,
+                       h.what_worked, h.what_failed, h.key_decisions,
+                       h.outcome, h.file_path, h.created_at,
+                       handoffs_fts.rank as score
+                FROM handoffs_fts
+                JOIN handoffs h ON handoffs_fts.rowid = h.rowid
+                WHERE handoffs_fts MATCH :query AND h.outcome = :outcome{i}
+                ORDER BY rank LIMIT :limit{i}
+            )
+        """)
+        params[f"outcome{i}"] = outcome
+        params[f"limit{i}"] = limit
+
+    cursor = conn.execute(" UNION ALL ".join(selects), params)
+    columns = [desc[0] for desc in cursor.description]
+    results = {outcome: [] for outcome in buckets}
+    for row in cursor.fetchall():
+        handoff = dict(zip(columns, row))
+        results[handoff["outcome"]].append(handoff)
+    return results
+
+
 def search_plans(conn: sqlite3.Connection, query: str, limit: int = 3) -> list:
     """Search plans using FTS5 with BM25 ranking."""
     sql = """
@@ -256,43 +352,7 @@ def main():
             print(f"Database not found: {db_path}")
             return
 
-        conn = sqlite3.connect(db_path)
-        handoff = get_handoff_by_span_id(conn, args.by_span_id)
-
-        if handoff and args.with_content and handoff.get('file_path'):
-            # Read full file content
-            file_path = Path(handoff['file_path'])
-            if file_path.exists():
-                handoff['content'] = file_path.read_text()
-
-            # Also get the ledger for this session
-            # Try session_name from handoff, or derive from folder path
-            session_name = handoff.get('session_name')
-            if not session_name and handoff.get('file_path'):
-                # Extract from path: thoughts/shared/handoffs/{session_name}/...
-                parts = Path(handoff['file_path']).parts
-                if 'handoffs' in parts:
-                    idx = parts.index('handoffs')
-                    if idx + 1 < len(parts):
-                        session_name = parts[idx + 1]
-
-            if session_name:
-                # Try to find ledger file directly first
-                ledger_path = Path(f"CONTINUITY_CLAUDE-{session_name}.md")
-                if ledger_path.exists():
-                    ledger = {
-                        'session_name': session_name,
-                        'file_path': str(ledger_path),
-                        'content': ledger_path.read_text()
-                    }
-                    handoff['ledger'] = ledger
-                else:
-                    # Fall back to DB lookup
-                    ledger = get_ledger_for_session(conn, session_name)
-                    if ledger:
-                        handoff['ledger'] = ledger
-
-        conn.close()
+        handoff = query_by_span_id(args.by_span_id, args.with_content, args.db)
 
         if args.json:
             print(json.dumps(handoff, indent=2, default=str))
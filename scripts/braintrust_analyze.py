@@ -42,18 +42,76 @@ Usage:
   uv run python -m runtime.harness scripts/braintrust_analyze.py \
     --weekly-summary
 
+  # Same commands under PyPy (JIT for the replay/rollup/format loops)
+  uv run --python pypy3.11 --extra pypy python -m runtime.harness \
+    scripts/braintrust_analyze.py --replay <session-id>
+
 Requires: BRAINTRUST_API_KEY in environment
+
+Optional accelerators (orjson, numpy, numba, pyarrow, ijson) are used when
+importable and skipped otherwise, so the script runs unchanged on PyPy where
+orjson and numba are unavailable.
 """
 
 import argparse
+import asyncio
+import functools
+import hashlib
+import io
+import itertools
 import json
 import os
 import re
+import sqlite3
 import sys
-from datetime import datetime, timedelta
+import time
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
+import aiohttp
 import requests
+from dotenv import dotenv_values
+from requests.adapters import HTTPAdapter
+
+# Sibling scripts dir isn't on sys.path when run via runtime.harness (runpy)
+SCRIPTS_DIR = Path(__file__).parent
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+try:
+    from artifact_query import get_db_path, query_by_span_id, search_handoffs_multi  # noqa: E402
+except ImportError:
+    # Optional: without the Context Graph script, handoff lookups find nothing
+    get_db_path = query_by_span_id = search_handoffs_multi = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Optional: faster decoding of large BTQL responses
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Optional: vectorized client-side aggregation
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None  # Optional: compiled per-row reduction (requires numpy)
+
+try:
+    import ijson
+except ImportError:
+    ijson = None  # Optional: incremental parsing of streamed BTQL responses
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None  # Optional: columnar decoding of large raw result sets
+
+# Parses bytes directly (no separate utf-8 decode step)
+json_loads = orjson.loads if orjson is not None else json.loads
+json_dumps = orjson.dumps if orjson is not None else (lambda obj: json.dumps(obj).encode())
 
 # Note: We use direct LLM-as-judge API calls via Braintrust proxy
 # instead of autoevals library for more control over prompts
@@ -67,18 +125,15 @@ import requests
 # Phase 2 will add qualitative scoring via autoevals
 
 
+@functools.cache
 def load_api_key() -> str:
     """Load API key from environment or .env file."""
-    # Try loading from .env files
+    # Try loading from .env files - first file that defines the key wins
     for path in [Path.home() / ".claude", Path.cwd(), *Path.cwd().parents]:
         env_file = path / ".env"
-        if env_file.exists():
-            with open(env_file) as f:
-                for line in f:
-                    if line.startswith("BRAINTRUST_API_KEY="):
-                        key = line.strip().split("=", 1)[1].strip('"\'')
-                        os.environ["BRAINTRUST_API_KEY"] = key
-                        break
+        if env_file.exists() and (key := dotenv_values(env_file).get("BRAINTRUST_API_KEY")):
+            os.environ["BRAINTRUST_API_KEY"] = key
+            break
 
     api_key = os.environ.get("BRAINTRUST_API_KEY")
     if not api_key:
@@ -88,15 +143,111 @@ def load_api_key() -> str:
     return api_key
 
 
+@functools.lru_cache(maxsize=8)
 def days_ago(n: int = 7) -> str:
-    """Get ISO date string for N days ago. BTQL doesn't support INTERVAL."""
-    return (datetime.utcnow() - timedelta(days=n)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    """Get ISO date string for N days ago. BTQL doesn't support INTERVAL.
+
+    Floored to the hour so repeat runs produce identical query text (and hit
+    the response cache).
+    """
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    return (now - timedelta(days=n)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@functools.cache
+def http_session() -> requests.Session:
+    """Shared session so TCP + TLS setup to Braintrust is paid once per run."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+    session.mount("https://", adapter)
+    return session
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write data via tmp file + rename so concurrent runs never see a partial file.
+
+    Every caller is a cache, so a failed write is ignored (the next run
+    just recomputes).
+    """
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+PROJECT_CACHE_FILE = Path.home() / ".claude" / "braintrust_project_cache.json"
 
 
+def read_project_cache() -> dict:
+    """Read the cached project key -> ID mapping (see project_cache_key)."""
+    try:
+        return json.loads(PROJECT_CACHE_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_project_cache(cache: dict) -> None:
+    """Write the project mapping atomically."""
+    atomic_write_bytes(PROJECT_CACHE_FILE, json.dumps(cache).encode())
+
+
+def api_key_fingerprint(api_key: str) -> str:
+    """Short, non-reversible tag for an API key (keys the project cache per org)."""
+    return hashlib.blake2b(api_key.encode(), digest_size=8).hexdigest()
+
+
+def project_cache_key(project_name: str, api_key: str) -> str:
+    """Cache key for a project: the same name in another org is another project."""
+    return f"{api_key_fingerprint(api_key)}:{project_name}"
+
+
+@functools.cache
 def get_project_id(project_name: str, api_key: str) -> str:
+    """Get project ID from name (cached on disk across runs, per API key)."""
+    key = project_cache_key(project_name, api_key)
+    project_id = read_project_cache().get(key)
+    if project_id:
+        return project_id
+
+    project_id = lookup_project_id(project_name, api_key)
+    cache = read_project_cache()
+    cache[key] = project_id
+    write_project_cache(cache)
+    return project_id
+
+
+# BTQL statuses that may mean the cached project ID is no longer ours:
+# project recreated (404) or the ID belongs to another org's key (401/403)
+STALE_PROJECT_STATUSES = frozenset({401, 403, 404})
+
+
+@functools.cache
+def refresh_project_id(project_id: str, api_key: str) -> str | None:
+    """Re-resolve a cached project ID that BTQL rejected.
+
+    Drops the entry and looks the project up again by the name it was cached
+    under for this API key. Returns None if project_id didn't come from the
+    cache for this key.
+    """
+    prefix = f"{api_key_fingerprint(api_key)}:"
+    cache = read_project_cache()
+    keys = [key for key, pid in cache.items() if pid == project_id and key.startswith(prefix)]
+    if not keys:
+        return None
+    for key in keys:
+        del cache[key]
+    write_project_cache(cache)
+    get_project_id.cache_clear()
+    return get_project_id(keys[0].removeprefix(prefix), api_key)
+
+
+def lookup_project_id(project_name: str, api_key: str) -> str:
     """Get project ID from name."""
     headers = {"Authorization": f"Bearer {api_key}"}
-    resp = requests.get(
+    resp = http_session().get(
         "https://api.braintrust.dev/v1/project",
         headers=headers,
         params={"project_name": project_name},
@@ -107,7 +258,7 @@ def get_project_id(project_name: str, api_key: str) -> str:
             return projects[0]["id"]
 
     # Try listing all projects and matching by name
-    resp = requests.get("https://api.braintrust.dev/v1/project", headers=headers)
+    resp = http_session().get("https://api.braintrust.dev/v1/project", headers=headers)
     if resp.status_code == 200:
         projects = resp.json().get("objects", [])
         for p in projects:
@@ -118,57 +269,276 @@ def get_project_id(project_name: str, api_key: str) -> str:
     sys.exit(1)
 
 
-def run_sql(project_id: str, query: str, api_key: str) -> list[dict]:
-    """Execute SQL query against Braintrust logs."""
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+FROM_LOGS_RE = re.compile(r"\bFROM\s+logs\b", re.IGNORECASE)
 
-    # Replace "FROM logs" with the project-scoped source
-    full_query = re.sub(
-        r"\bFROM\s+logs\b", f"FROM project_logs('{project_id}')", query, flags=re.IGNORECASE
-    )
 
-    resp = requests.post(
+def scope_query(project_id: str, query: str) -> str:
+    """Replace "FROM logs" with the project-scoped source."""
+    return FROM_LOGS_RE.sub(f"FROM project_logs('{project_id}')", query)
+
+
+PARAM_RE = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+
+def sql_literal(value) -> str:
+    """Render a Python value as a BTQL literal (strings quoted and escaped)."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def bind_params(query: str, params: dict | None) -> str:
+    """Substitute :name placeholders with escaped literals.
+
+    BTQL's /btql endpoint takes no bind parameters, so binding happens here:
+    query text stays a fixed template and caller-supplied IDs can't break
+    out of their string literal.
+    """
+    if not params:
+        return query
+    return PARAM_RE.sub(lambda m: sql_literal(params[m.group(1)]), query)
+
+
+SQL_CACHE_DIR = Path.home() / ".claude" / "bt_cache"
+SQL_CACHE_TTL = 300  # seconds; most queries cover a 7-day window
+sql_cache_enabled = True  # --no-cache disables
+
+
+def sql_cache_path(project_id: str, query: str) -> Path:
+    """Cache file for a (project, query) pair."""
+    key = hashlib.blake2b(f"{project_id}\0{query}".encode(), digest_size=16).hexdigest()
+    return SQL_CACHE_DIR / f"{key}.json"
+
+
+def sql_cache_get(project_id: str, query: str) -> list[dict] | None:
+    """Return cached rows if a fresh entry exists."""
+    if not sql_cache_enabled:
+        return None
+    try:
+        entry = json_loads(sql_cache_path(project_id, query).read_bytes())
+    except (OSError, ValueError):
+        return None
+    if time.time() - entry.get("ts", 0) > SQL_CACHE_TTL:
+        return None
+    return entry.get("data")
+
+
+def sql_cache_put(project_id: str, query: str, data: list[dict]) -> None:
+    """Store rows atomically (tmp file + rename)."""
+    if not sql_cache_enabled:
+        return
+    try:
+        entry = json_dumps({"ts": time.time(), "data": data})
+    except TypeError:
+        return  # e.g. Parquet binary values the stdlib encoder can't serialize
+    atomic_write_bytes(sql_cache_path(project_id, query), entry)
+
+
+def btql_features_path() -> Path:
+    """Where probed BTQL feature support is remembered between runs."""
+    return SQL_CACHE_DIR / "features.json"
+
+
+@functools.cache
+def btql_features() -> dict:
+    """Known BTQL feature support ({feature: bool}); unprobed features are absent."""
+    try:
+        return json.loads(btql_features_path().read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def record_btql_feature(feature: str, supported: bool) -> None:
+    """Remember a probe result so later runs skip the failing query."""
+    features = btql_features()
+    features[feature] = supported
+    atomic_write_bytes(btql_features_path(), json.dumps(features).encode())
+
+
+class BTQLError(Exception):
+    """BTQL rejected a query (e.g. unsupported function or syntax)."""
+
+
+def run_sql(project_id: str, query: str, api_key: str, params: dict | None = None,
+            retry: bool = True, raise_errors: bool = False, cache: bool = True) -> list[dict]:
+    """Execute SQL query against Braintrust logs (cached for SQL_CACHE_TTL seconds).
+
+    :name placeholders in query are bound from params (see bind_params). With
+    raise_errors, a failed query raises BTQLError instead of returning [].
+    Pass cache=False for "latest session" lookups, which must see new sessions.
+    """
+    query = bind_params(query, params)
+    cached = sql_cache_get(project_id, query) if cache else None
+    if cached is not None:
+        return cached
+
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    resp = http_session().post(
         "https://api.braintrust.dev/btql",
         headers=headers,
-        json={"query": full_query, "fmt": "json"},
+        json={"query": scope_query(project_id, query), "fmt": "json"},
     )
 
     if resp.status_code == 200:
-        return resp.json().get("data", [])
+        data = json_loads(resp.content).get("data", [])
+        if cache:
+            sql_cache_put(project_id, query, data)
+        return data
+    elif (resp.status_code in STALE_PROJECT_STATUSES and retry
+          and (fresh_id := refresh_project_id(project_id, api_key))):
+        # Cached project ID went stale (recreated, or another org's) - retry once
+        return run_sql(fresh_id, query, api_key, retry=False, raise_errors=raise_errors,
+                       cache=cache)
+    elif raise_errors:
+        raise BTQLError(f"{resp.status_code} - {resp.text}")
     else:
         print(f"SQL Error: {resp.status_code} - {resp.text}", file=sys.stderr)
         return []
 
 
+def run_sql_iter(project_id: str, query: str, api_key: str, params: dict | None = None,
+                 retry: bool = True, raise_errors: bool = False):
+    """Like run_sql, but yield rows as they are parsed off the wire.
+
+    Streams the response through ijson when available so the first rows can
+    be printed before the whole body arrives; otherwise falls back to run_sql.
+    With raise_errors, BTQLError is raised when the first row is requested.
+    """
+    if ijson is None:
+        yield from run_sql(project_id, query, api_key, params, retry, raise_errors)
+        return
+
+    query = bind_params(query, params)
+    cached = sql_cache_get(project_id, query)
+    if cached is not None:
+        yield from cached
+        return
+
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    with http_session().post(
+        "https://api.braintrust.dev/btql",
+        headers=headers,
+        json={"query": scope_query(project_id, query), "fmt": "json"},
+        stream=True,
+    ) as resp:
+        if resp.status_code == 200:
+            resp.raw.decode_content = True  # Let urllib3 undo gzip
+            rows = []
+            for row in ijson.items(resp.raw, "data.item", use_float=True):
+                rows.append(row)
+                yield row
+            sql_cache_put(project_id, query, rows)
+            return
+        elif (resp.status_code in STALE_PROJECT_STATUSES and retry
+              and (fresh_id := refresh_project_id(project_id, api_key))):
+            # Cached project ID went stale (recreated, or another org's) - retry once
+            yield from run_sql_iter(fresh_id, query, api_key, retry=False,
+                                    raise_errors=raise_errors)
+        elif raise_errors:
+            raise BTQLError(f"{resp.status_code} - {resp.text}")
+        else:
+            print(f"SQL Error: {resp.status_code} - {resp.text}", file=sys.stderr)
+
+
+def btql_session():
+    """Create an aiohttp session for fanning out BTQL queries concurrently."""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=16, limit_per_host=16)
+    )
+
+
+async def run_sql_async(session, project_id: str, query: str, api_key: str,
+                        params: dict | None = None, retry: bool = True,
+                        raise_errors: bool = False) -> list[dict]:
+    """Async variant of run_sql; independent queries can run under asyncio.gather.
+
+    With raise_errors, a failed query raises BTQLError instead of returning [],
+    so callers can tell "no rows" apart from "query not supported".
+    """
+    query = bind_params(query, params)
+    cached = sql_cache_get(project_id, query)
+    if cached is not None:
+        return cached
+
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    async with session.post(
+        "https://api.braintrust.dev/btql",
+        headers=headers,
+        json={"query": scope_query(project_id, query), "fmt": "json"},
+    ) as resp:
+        if resp.status == 200:
+            data = json_loads(await resp.read()).get("data", [])
+            sql_cache_put(project_id, query, data)
+            return data
+        if (resp.status in STALE_PROJECT_STATUSES and retry
+                and (fresh_id := refresh_project_id(project_id, api_key))):
+            return await run_sql_async(session, fresh_id, query, api_key,
+                                       retry=False, raise_errors=raise_errors)
+        error = await resp.text()
+        if raise_errors:
+            raise BTQLError(f"{resp.status} - {error}")
+        print(f"SQL Error: {resp.status} - {error}", file=sys.stderr)
+        return []
+
+
+async def run_sql_columns(session, project_id: str, query: str, api_key: str,
+                          params: dict | None = None, retry: bool = True) -> dict[str, list]:
+    """Execute a query and return results column-wise ({column: [values]}).
+
+    With pyarrow installed, BTQL is asked for Parquet and the body is decoded
+    straight into columns instead of building one dict per row. Otherwise (or
+    if the Parquet request fails) JSON rows are fetched and transposed. Both
+    paths share run_sql's response cache and stale-project retry.
+    """
+    query = bind_params(query, params)
+    if pq is not None:
+        columns_key = f"{query}\0columns"  # Cached apart from the JSON rows
+        cached = sql_cache_get(project_id, columns_key)
+        if cached is not None:
+            return cached
+
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        async with session.post(
+            "https://api.braintrust.dev/btql",
+            headers=headers,
+            json={"query": scope_query(project_id, query), "fmt": "parquet"},
+        ) as resp:
+            if resp.status == 200:
+                columns = pq.read_table(io.BytesIO(await resp.read())).to_pydict()
+                # Timestamps decode to datetimes; match the ISO strings JSON rows carry
+                columns = {name: [v.isoformat() if isinstance(v, date) else v for v in values]
+                           for name, values in columns.items()}
+                sql_cache_put(project_id, columns_key, columns)
+                return columns
+            if resp.status in STALE_PROJECT_STATUSES and retry:
+                if fresh_id := refresh_project_id(project_id, api_key):
+                    return await run_sql_columns(session, fresh_id, query, api_key, retry=False)
+                retry = False  # Already re-resolved; don't look it up again below
+
+    rows = await run_sql_async(session, project_id, query, api_key, retry=retry)
+    names = dict.fromkeys(name for row in rows for name in row)
+    return {name: [row.get(name) for row in rows] for name in names}
+
+
 def get_hierarchical_context(root_span_id: str) -> dict:
     """Get handoff + ledger from Context Graph for a session.
 
     Returns dict with 'handoff' and 'ledger' keys (may be None).
     """
-    import subprocess
-    import json as json_mod
-
-    project_dir = os.environ.get("CLAUDE_PROJECT_DIR", os.getcwd())
-    query_script = Path(project_dir) / "scripts" / "artifact_query.py"
-
-    if not query_script.exists():
+    if query_by_span_id is None:
         return {"handoff": None, "ledger": None}
+    project_dir = os.environ.get("CLAUDE_PROJECT_DIR", os.getcwd())
 
     try:
-        result = subprocess.run(
-            ["uv", "run", "python", str(query_script),
-             "--by-span-id", root_span_id, "--with-content", "--json"],
-            capture_output=True,
-            text=True,
-            timeout=10,
-            cwd=project_dir
-        )
-        if result.returncode == 0 and result.stdout.strip():
-            data = json_mod.loads(result.stdout)
-            return {
-                "handoff": data if data else None,
-                "ledger": data.get("ledger") if data else None
-            }
+        # Query in-process instead of spawning a fresh interpreter per lookup
+        data = query_by_span_id(root_span_id, with_content=True, base_dir=project_dir)
+        if data:
+            return {"handoff": data, "ledger": data.get("ledger")}
     except Exception as e:
         print(f"  Context Graph query failed: {e}")
 
@@ -192,6 +562,50 @@ def format_tokens(tokens: int) -> str:
     return str(tokens)
 
 
+def session_breakdown(project_id: str, api_key: str, session_id: str) -> dict:
+    """Per-session tool/agent/skill counts and token total in one BTQL round trip.
+
+    A single GROUP BY over (span type, tool, agent, skill) replaces separate
+    per-dimension queries; rows are partitioned client-side.
+    """
+    rows = run_sql(project_id, """
+        SELECT
+            span_attributes['type'] as span_type,
+            COALESCE(metadata['tool_name'], span_attributes['name']) as tool,
+            metadata['agent_type'] as agent,
+            metadata['skill_name'] as skill,
+            COUNT(*) as count,
+            SUM(COALESCE(metrics['tokens'], 0)) as tokens
+        FROM logs
+        WHERE root_span_id = :session_id
+        GROUP BY 1, 2, 3, 4
+    """, api_key, params={"session_id": session_id})
+
+    tools, agents, skills = {}, {}, {}
+    span_count = total_tokens = 0
+    for row in rows:
+        count = int(row.get("count") or 0)
+        span_count += count
+        total_tokens += int(row.get("tokens") or 0)
+        if row.get("span_type") == "tool" and row.get("tool"):
+            tools[row["tool"]] = tools.get(row["tool"], 0) + count
+        if row.get("agent"):
+            agents[row["agent"]] = agents.get(row["agent"], 0) + count
+        if row.get("skill"):
+            skills[row["skill"]] = skills.get(row["skill"], 0) + count
+
+    def by_count(counts: dict) -> dict:
+        return dict(sorted(counts.items(), key=lambda kv: kv[1], reverse=True))
+
+    return {
+        "span_count": span_count,
+        "total_tokens": total_tokens,
+        "tools": by_count(tools),
+        "agents": by_count(agents),
+        "skills": by_count(skills),
+    }
+
+
 def analyze_last_session(project_id: str, api_key: str):
     """Analyze the most recent session."""
     # Get session info
@@ -205,7 +619,7 @@ def analyze_last_session(project_id: str, api_key: str):
         GROUP BY root_span_id
         ORDER BY started DESC
         LIMIT 1
-    """, api_key)
+    """, api_key, cache=False)
 
     if not sessions:
         print("No sessions found")
@@ -214,50 +628,7 @@ def analyze_last_session(project_id: str, api_key: str):
     session = sessions[0]
     session_id = session["session_id"]
 
-    # Get tool breakdown
-    tools = run_sql(project_id, f"""
-        SELECT
-            COALESCE(metadata['tool_name'], span_attributes['name']) as tool,
-            COUNT(*) as count
-        FROM logs
-        WHERE root_span_id = '{session_id}'
-          AND span_attributes['type'] = 'tool'
-        GROUP BY 1
-        ORDER BY count DESC
-        LIMIT 10
-    """, api_key)
-
-    # Get agent usage
-    agents = run_sql(project_id, f"""
-        SELECT
-            metadata['agent_type'] as agent,
-            COUNT(*) as count
-        FROM logs
-        WHERE root_span_id = '{session_id}'
-          AND metadata['agent_type'] IS NOT NULL
-        GROUP BY 1
-        ORDER BY count DESC
-    """, api_key)
-
-    # Get skill usage
-    skills = run_sql(project_id, f"""
-        SELECT
-            metadata['skill_name'] as skill,
-            COUNT(*) as count
-        FROM logs
-        WHERE root_span_id = '{session_id}'
-          AND metadata['skill_name'] IS NOT NULL
-        GROUP BY 1
-        ORDER BY count DESC
-    """, api_key)
-
-    # Get token estimate (from LLM spans if available)
-    tokens_result = run_sql(project_id, f"""
-        SELECT
-            SUM(COALESCE(metrics['tokens'], 0)) as total_tokens
-        FROM logs
-        WHERE root_span_id = '{session_id}'
-    """, api_key)
+    breakdown = session_breakdown(project_id, api_key, session_id)
 
     # Output
     print(f"## Session Analysis")
@@ -265,29 +636,29 @@ def analyze_last_session(project_id: str, api_key: str):
     print(f"**Started:** {session['started']}")
     print(f"**Spans:** {session['span_count']}")
 
-    total_tokens = tokens_result[0].get("total_tokens", 0) if tokens_result else 0
+    total_tokens = breakdown["total_tokens"]
     if total_tokens:
         print(f"**Tokens:** {format_tokens(int(total_tokens))}")
 
-    if tools:
+    if breakdown["tools"]:
         print(f"\n### Tool Usage")
-        for t in tools[:7]:
-            print(f"- {t['tool']}: {t['count']}")
+        for tool, count in list(breakdown["tools"].items())[:7]:
+            print(f"- {tool}: {count}")
 
-    if agents:
+    if breakdown["agents"]:
         print(f"\n### Agents Spawned")
-        for a in agents:
-            print(f"- {a['agent']}: {a['count']}")
+        for agent, count in breakdown["agents"].items():
+            print(f"- {agent}: {count}")
 
-    if skills:
+    if breakdown["skills"]:
         print(f"\n### Skills Activated")
-        for s in skills:
-            print(f"- {s['skill']}: {s['count']}")
+        for skill, count in breakdown["skills"].items():
+            print(f"- {skill}: {count}")
 
 
 def list_sessions(project_id: str, api_key: str, limit: int = 5):
     """List recent sessions with summary."""
-    sessions = run_sql(project_id, f"""
+    sessions = run_sql(project_id, """
         SELECT
             root_span_id as session_id,
             MIN(created) as started,
@@ -297,8 +668,8 @@ def list_sessions(project_id: str, api_key: str, limit: int = 5):
         FROM logs
         GROUP BY root_span_id
         ORDER BY started DESC
-        LIMIT {limit}
-    """, api_key)
+        LIMIT :limit
+    """, api_key, params={"limit": int(limit)})
 
     if not sessions:
         print("No sessions found")
@@ -316,17 +687,17 @@ def list_sessions(project_id: str, api_key: str, limit: int = 5):
 def agent_stats(project_id: str, api_key: str):
     """Show agent usage statistics."""
     since = days_ago()
-    stats = run_sql(project_id, f"""
+    stats = run_sql(project_id, """
         SELECT
             metadata['agent_type'] as agent,
             COUNT(*) as runs,
             COUNT(DISTINCT root_span_id) as sessions
         FROM logs
         WHERE metadata['agent_type'] IS NOT NULL
-          AND created > '{since}'
+          AND created > :since
         GROUP BY 1
         ORDER BY runs DESC
-    """, api_key)
+    """, api_key, params={"since": since})
 
     if not stats:
         print("No agent data found (last 7 days)")
@@ -344,17 +715,17 @@ def agent_stats(project_id: str, api_key: str):
 def skill_stats(project_id: str, api_key: str):
     """Show skill usage statistics."""
     since = days_ago()
-    stats = run_sql(project_id, f"""
+    stats = run_sql(project_id, """
         SELECT
             metadata['skill_name'] as skill,
             COUNT(*) as activations,
             COUNT(DISTINCT root_span_id) as sessions
         FROM logs
         WHERE metadata['skill_name'] IS NOT NULL
-          AND created > '{since}'
+          AND created > :since
         GROUP BY 1
         ORDER BY activations DESC
-    """, api_key)
+    """, api_key, params={"since": since})
 
     if not stats:
         print("No skill data found (last 7 days)")
@@ -373,7 +744,7 @@ def detect_loops(project_id: str, api_key: str):
     """Find sessions with repeated tool calls (potential loops)."""
     since = days_ago()
     # BTQL doesn't support HAVING, so fetch all and filter client-side
-    all_counts = run_sql(project_id, f"""
+    all_counts = run_sql(project_id, """
         SELECT
             root_span_id as session_id,
             COALESCE(metadata['tool_name'], span_attributes['name']) as tool,
@@ -382,11 +753,11 @@ def detect_loops(project_id: str, api_key: str):
             MAX(created) as last_call
         FROM logs
         WHERE span_attributes['type'] = 'tool'
-          AND created > '{since}'
+          AND created > :since
         GROUP BY root_span_id, 2
         ORDER BY call_count DESC
         LIMIT 100
-    """, api_key)
+    """, api_key, params={"since": since})
 
     # Client-side filter: only keep tools called >5 times
     loops = [l for l in (all_counts or []) if l.get('call_count', 0) > 5][:15]
@@ -403,39 +774,101 @@ def detect_loops(project_id: str, api_key: str):
         print()
 
 
+# Metadata key -> label for the span prefix, in priority order
+PREFIX_KEYS = (("agent_type", "Agent"), ("skill_name", "Skill"), ("tool_name", "Tool"))
+
+# Span type -> (label, field) pairs shown for that span's content
+SPAN_FIELDS = {
+    "llm": (("Input", "input"), ("Output", "output")),
+    "task": (("Message", "input"),),
+    "tool": (("Input", "input"), ("Output", "output")),
+}
+
+
+def span_prefix(metadata: dict) -> str:
+    """'[Agent:x] ' / '[Skill:x] ' / '[Tool:x] ' for the first metadata key set."""
+    for key, label in PREFIX_KEYS:
+        value = metadata.get(key)
+        if value:
+            return f"[{label}:{value}] "
+    return ""
+
+
+def write_clean(buf: io.StringIO, text, max_len: int) -> None:
+    """Write text to buf, stripped and truncated to max_len.
+
+    Long fields are sliced before stripping so only the kept part is copied.
+    """
+    text = str(text)
+    if len(text) > max_len:
+        buf.write(text[:max_len].lstrip())
+        buf.write(f"... [truncated {len(text) - max_len} chars]")
+    else:
+        buf.write(text.strip())
+
+
 def replay_session(project_id: str, api_key: str, session_id: str):
     """Replay a specific session showing the sequence of actions with actual content."""
-    # Handle partial session ID
+    # Partial IDs are matched by prefix in the main query itself (no separate
+    # resolve round trip); the concrete session is taken from the first row.
+    # Ordering by root_span_id first gives the LIMIT to one session's spans
+    # before any other session the prefix matches
     if len(session_id) < 36:
-        # Find full session ID
-        sessions = run_sql(project_id, f"""
-            SELECT DISTINCT root_span_id
+        match, params = "root_span_id LIKE :prefix", {"prefix": f"{session_id}%"}
+    else:
+        match, params = "root_span_id = :session_id", {"session_id": session_id}
+
+    def fetch_spans(trim: bool):
+        """Open the span stream and peek its first row (None if empty)."""
+        # Only the first 200 chars of input/output are shown, so trim
+        # server-side (with headroom for leading whitespace) when BTQL allows
+        fields = ("SUBSTRING(CAST(input AS VARCHAR), 1, 400) as input, "
+                  "SUBSTRING(CAST(output AS VARCHAR), 1, 400) as output"
+                  if trim else "input, output")
+        rows = run_sql_iter(project_id, f"""
+            SELECT
+                root_span_id,
+                created,
+                {fields},
+                span_attributes,
+                metadata
             FROM logs
-            WHERE root_span_id LIKE '{session_id}%'
-            LIMIT 1
-        """, api_key)
-        if sessions:
-            session_id = sessions[0]["root_span_id"]
-        else:
-            print(f"Session not found: {session_id}")
-            return
-
-    spans = run_sql(project_id, f"""
-        SELECT
-            created,
-            input,
-            output,
-            span_attributes,
-            metadata
-        FROM logs
-        WHERE root_span_id = '{session_id}'
-        ORDER BY created
-        LIMIT 200
-    """, api_key)
-
-    if not spans:
-        print(f"No data for session: {session_id}")
+            WHERE {match}
+            ORDER BY root_span_id, created
+            LIMIT 200
+        """, api_key, params=params, raise_errors=True)
+        return rows, next(rows, None)
+
+    # Peek so an empty result is reported before the header is printed; if
+    # BTQL rejects SUBSTRING/CAST, fall back to full fields (remembered)
+    trim = btql_features().get("replay_substring") is not False
+    try:
+        try:
+            spans, first = fetch_spans(trim)
+        except BTQLError:
+            if not trim:
+                raise
+            spans, first = fetch_spans(False)
+            record_btql_feature("replay_substring", False)
+    except BTQLError as e:
+        print(f"SQL Error: {e}", file=sys.stderr)
+        return
+    if first is None:
+        print(f"Session not found: {session_id}" if "prefix" in params
+              else f"No data for session: {session_id}")
         return
+    session_id = first["root_span_id"]
+    # A short prefix can match several sessions; keep the first one's spans
+    # and count the rest, so the ambiguity is reported instead of hidden
+    other_spans = 0
+
+    def session_spans():
+        nonlocal other_spans
+        for s in itertools.chain([first], spans):
+            if s["root_span_id"] == session_id:
+                yield s
+            else:
+                other_spans += 1
 
     print(f"## Session Replay: `{session_id[:12]}...`")
     print()
@@ -449,46 +882,23 @@ def replay_session(project_id: str, api_key: str, session_id: str):
             return text
         return text[:max_len] + "..."
 
-    for i, s in enumerate(spans, 1):
+    for i, s in enumerate(session_spans(), 1):
         span_attrs = s.get("span_attributes") or {}
         metadata = s.get("metadata") or {}
         span_type = span_attrs.get("type", "unknown")
         span_name = span_attrs.get("name", "unknown")
 
         # Determine prefix
-        prefix = ""
-        if metadata.get("agent_type"):
-            prefix = f"[Agent:{metadata['agent_type']}] "
-        elif metadata.get("skill_name"):
-            prefix = f"[Skill:{metadata['skill_name']}] "
-        elif metadata.get("tool_name"):
-            prefix = f"[Tool:{metadata['tool_name']}] "
+        prefix = span_prefix(metadata)
 
         # Show span header
         print(f"{i:3}. {prefix}**{span_name}** ({span_type})")
 
-        # Show content based on span type
-        if span_type == "llm":
-            # LLM spans have both input and output
-            input_text = s.get("input")
-            output_text = s.get("output")
-            if input_text:
-                print(f"     Input: {truncate(input_text)}")
-            if output_text:
-                print(f"     Output: {truncate(output_text)}")
-        elif span_type == "task":
-            # Task spans have user message in input
-            input_text = s.get("input")
-            if input_text:
-                print(f"     Message: {truncate(input_text)}")
-        elif span_type == "tool":
-            # Tool spans may have input/output
-            input_text = s.get("input")
-            output_text = s.get("output")
-            if input_text:
-                print(f"     Input: {truncate(input_text)}")
-            if output_text:
-                print(f"     Output: {truncate(output_text)}")
+        # Show content based on span type (task spans carry the user message in input)
+        for label, field in SPAN_FIELDS.get(span_type, ()):
+            text = s.get(field)
+            if text:
+                print(f"     {label}: {truncate(text)}")
 
         # Show tool calls from metadata if present
         if metadata.get("tool_calls"):
@@ -501,46 +911,159 @@ def replay_session(project_id: str, api_key: str, session_id: str):
 
         print()  # Blank line between spans
 
+    if other_spans:
+        print(f"Note: `{params['prefix'][:-1]}` also matches other sessions "
+              f"({other_spans} of their spans skipped); pass a longer ID to pick one.")
 
-def weekly_summary(project_id: str, api_key: str):
-    """Generate a weekly analysis summary."""
-    since = days_ago()
-    # BTQL doesn't support DATE(), so we fetch raw data and aggregate client-side
-    raw_data = run_sql(project_id, f"""
+
+def aggregate_daily(created: list, session_ids: list, values: list,
+                    value_name: str) -> list[dict]:
+    """Client-side daily rollup: distinct sessions and summed values per day."""
+    if np is not None and created:
+        return aggregate_daily_np(created, session_ids, values, value_name)
+
+    sessions: dict[str, set] = {}
+    totals: dict[str, int] = {}
+    for ts, session_id, value in zip(created, session_ids, values):
+        day = (ts or "")[:10]  # Extract YYYY-MM-DD
+        sessions.setdefault(day, set()).add(session_id)
+        totals[day] = totals.get(day, 0) + value
+    return [{"day": day, "sessions": len(sessions[day]), value_name: totals[day]}
+            for day in sorted(sessions)]
+
+
+def daily_reduce(day_ix, sess_ix, values, n_days: int, n_sessions: int):
+    """Per-day value totals and distinct-session counts in a single pass.
+
+    Compiled with numba when available; only called in that case.
+    """
+    totals = np.zeros(n_days, dtype=np.float64)
+    sessions = np.zeros(n_days, dtype=np.int64)
+    seen = np.zeros((n_days, n_sessions), dtype=np.bool_)
+    for i in range(day_ix.shape[0]):
+        day = day_ix[i]
+        totals[day] += values[i]
+        if not seen[day, sess_ix[i]]:
+            seen[day, sess_ix[i]] = True
+            sessions[day] += 1
+    return totals, sessions
+
+
+if njit is not None:
+    daily_reduce = njit(cache=True)(daily_reduce)
+
+
+def aggregate_daily_np(created: list, session_ids: list, values: list,
+                       value_name: str) -> list[dict]:
+    """NumPy version of aggregate_daily: np.unique + np.bincount instead of a row loop."""
+    days = np.array([ts or "" for ts in created], dtype="U10")  # Truncates to YYYY-MM-DD
+    day_names, day_ix = np.unique(days, return_inverse=True)
+    session_names, sess_ix = np.unique(np.array([str(s) for s in session_ids]),
+                                       return_inverse=True)
+    weights = np.asarray(values, dtype=np.float64)
+
+    if njit is not None:
+        totals, sessions = daily_reduce(day_ix.astype(np.int64), sess_ix.astype(np.int64),
+                                        weights, len(day_names), len(session_names))
+    else:
+        totals = np.bincount(day_ix, weights=weights, minlength=len(day_names))
+        # Distinct sessions per day = distinct (day, session) pairs, counted by day
+        pairs = np.unique(day_ix.astype(np.int64) * len(session_names) + sess_ix)
+        sessions = np.bincount(pairs // len(session_names), minlength=len(day_names))
+
+    return [{"day": str(day), "sessions": int(n), value_name: int(total)}
+            for day, n, total in zip(day_names, sessions, totals)]
+
+
+async def daily_rollup(session, project_id: str, api_key: str, since: str,
+                       value_name: str, value_sql: str, raw_sql: str, raw_value) -> list[dict]:
+    """Per-day distinct sessions plus one aggregate (value_sql as value_name).
+
+    Grouping happens server-side on SUBSTRING(created, 1, 10) so only one row
+    per day comes back. Session counts use APPROX_COUNT_DISTINCT unless BTQL
+    is known not to support it (probed once, remembered in features.json).
+    If BTQL rejects the pushed-down query altogether, raw columns
+    (created, root_span_id, raw_sql) are fetched and rolled up client-side,
+    mapping each raw_sql value through raw_value.
+    """
+    rollup_sql = f"""
+        SELECT
+            SUBSTRING(created, 1, 10) as day,
+            {{sessions_sql}} as sessions,
+            {value_sql} as {value_name}
+        FROM logs
+        WHERE created > :since
+        GROUP BY 1
+        ORDER BY 1
+    """
+    params = {"since": since}
+
+    approx = btql_features().get("approx_count_distinct")
+    if approx is not False:
+        try:
+            daily = await run_sql_async(
+                session, project_id,
+                rollup_sql.format(sessions_sql="APPROX_COUNT_DISTINCT(root_span_id)"),
+                api_key, params=params, raise_errors=True,
+            )
+        except BTQLError:
+            pass
+        else:
+            if approx is None:
+                record_btql_feature("approx_count_distinct", True)
+            return daily
+    try:
+        daily = await run_sql_async(
+            session, project_id, rollup_sql.format(sessions_sql="COUNT(DISTINCT root_span_id)"),
+            api_key, params=params, raise_errors=True,
+        )
+    except BTQLError:
+        pass
+    else:
+        if approx is None:
+            # Only blame the approximation once the exact query is known to work
+            record_btql_feature("approx_count_distinct", False)
+        return daily
+
+    raw = await run_sql_columns(session, project_id, f"""
         SELECT
             created,
             root_span_id,
-            span_attributes['type'] as span_type
+            {raw_sql} as raw
         FROM logs
-        WHERE created > '{since}'
+        WHERE created > :since
         ORDER BY created
         LIMIT 1000
-    """, api_key)
-
-    # Client-side aggregation by day
-    from collections import defaultdict
-    daily_stats = defaultdict(lambda: {"sessions": set(), "tool_calls": 0})
-    for row in raw_data or []:
-        day = row.get("created", "")[:10]  # Extract YYYY-MM-DD
-        daily_stats[day]["sessions"].add(row.get("root_span_id"))
-        if row.get("span_type") == "tool":
-            daily_stats[day]["tool_calls"] += 1
-
-    daily = [{"day": k, "sessions": len(v["sessions"]), "tool_calls": v["tool_calls"]}
-             for k, v in sorted(daily_stats.items())]
-
-    # Top tools
-    top_tools = run_sql(project_id, f"""
-        SELECT
-            COALESCE(metadata['tool_name'], span_attributes['name']) as tool,
-            COUNT(*) as count
-        FROM logs
-        WHERE span_attributes['type'] = 'tool'
-          AND created > '{since}'
-        GROUP BY 1
-        ORDER BY count DESC
-        LIMIT 5
-    """, api_key)
+    """, api_key, params=params)
+    values = [raw_value(v) for v in raw.get("raw", [])]
+    return aggregate_daily(raw.get("created", []), raw.get("root_span_id", []),
+                           values, value_name)
+
+
+async def weekly_summary(project_id: str, api_key: str):
+    """Generate a weekly analysis summary."""
+    since = days_ago()
+    async with btql_session() as session:
+        daily, top_tools = await asyncio.gather(
+            daily_rollup(
+                session, project_id, api_key, since, "tool_calls",
+                value_sql="COUNT(*) FILTER (WHERE span_attributes['type'] = 'tool')",
+                raw_sql="span_attributes['type']",
+                raw_value=lambda span_type: int(span_type == "tool"),
+            ),
+            # Top tools
+            run_sql_async(session, project_id, """
+                SELECT
+                    COALESCE(metadata['tool_name'], span_attributes['name']) as tool,
+                    COUNT(*) as count
+                FROM logs
+                WHERE span_attributes['type'] = 'tool'
+                  AND created > :since
+                GROUP BY 1
+                ORDER BY count DESC
+                LIMIT 5
+            """, api_key, params={"since": since}),
+        )
 
     print("## Weekly Summary")
     print()
@@ -557,31 +1080,16 @@ def weekly_summary(project_id: str, api_key: str):
             print(f"- {t['tool']}: {t['count']}")
 
 
-def token_trends(project_id: str, api_key: str):
+async def token_trends(project_id: str, api_key: str):
     """Show token usage trends."""
     since = days_ago()
-    # BTQL doesn't support DATE(), so we fetch raw data and aggregate client-side
-    raw_data = run_sql(project_id, f"""
-        SELECT
-            created,
-            root_span_id,
-            metrics['tokens'] as tokens
-        FROM logs
-        WHERE created > '{since}'
-        ORDER BY created
-        LIMIT 1000
-    """, api_key)
-
-    # Client-side aggregation by day
-    from collections import defaultdict
-    daily_stats = defaultdict(lambda: {"sessions": set(), "tokens": 0})
-    for row in raw_data or []:
-        day = row.get("created", "")[:10]  # Extract YYYY-MM-DD
-        daily_stats[day]["sessions"].add(row.get("root_span_id"))
-        daily_stats[day]["tokens"] += row.get("tokens") or 0
-
-    trends = [{"day": k, "sessions": len(v["sessions"]), "total_tokens": v["tokens"]}
-              for k, v in sorted(daily_stats.items())]
+    async with btql_session() as session:
+        trends = await daily_rollup(
+            session, project_id, api_key, since, "total_tokens",
+            value_sql="SUM(COALESCE(metrics['tokens'], 0))",
+            raw_sql="metrics['tokens']",
+            raw_value=lambda tokens: tokens or 0,
+        )
 
     if not trends:
         print("No token data found")
@@ -598,50 +1106,18 @@ def token_trends(project_id: str, api_key: str):
 
 def get_session_metrics(project_id: str, api_key: str, session_id: str) -> dict:
     """Gather all metrics for a session."""
-    # Token count
-    tokens = run_sql(project_id, f"""
-        SELECT SUM(COALESCE(metrics['tokens'], 0)) as total
-        FROM logs
-        WHERE root_span_id = '{session_id}'
-    """, api_key)
-
-    # Tool counts - extract tool name, handling different formats
-    tools = run_sql(project_id, f"""
-        SELECT
-            COALESCE(metadata['tool_name'], span_attributes['name']) as tool,
-            COUNT(*) as count
-        FROM logs
-        WHERE root_span_id = '{session_id}'
-          AND span_attributes['type'] = 'tool'
-        GROUP BY 1
-    """, api_key)
-
-    # Span count for session
-    spans = run_sql(project_id, f"""
-        SELECT COUNT(*) as total
-        FROM logs
-        WHERE root_span_id = '{session_id}'
-    """, api_key)
-
-    # Agent durations (count-based for now, timing TODO)
-    agents = run_sql(project_id, f"""
-        SELECT metadata['agent_type'] as agent, COUNT(*) as count
-        FROM logs
-        WHERE root_span_id = '{session_id}'
-          AND metadata['agent_type'] IS NOT NULL
-        GROUP BY 1
-    """, api_key)
-
-    # Build tool counts (metadata['tool_name'] already has correct names)
-    tool_counts = {t["tool"]: t["count"] for t in tools if t.get("tool")} if tools else {}
+    breakdown = session_breakdown(project_id, api_key, session_id)
+    # metadata['tool_name'] already has correct names
+    tool_counts = breakdown["tools"]
 
     return {
-        "total_tokens": int(tokens[0]["total"] or 0) if tokens else 0,
-        "span_count": int(spans[0]["total"] or 0) if spans else 0,
+        "total_tokens": breakdown["total_tokens"],
+        "span_count": breakdown["span_count"],
         "tool_calls": sum(tool_counts.values()),
         "tool_counts": tool_counts,
         "duration_seconds": 0,  # TODO: calculate from span timing
-        "agent_durations": {a["agent"]: 0 for a in agents} if agents else {}
+        # Agent durations (count-based for now, timing TODO)
+        "agent_durations": {agent: 0 for agent in breakdown["agents"]}
     }
 
 
@@ -650,6 +1126,18 @@ def get_session_metrics(project_id: str, api_key: str, session_id: str) -> dict:
 # ============================================================================
 
 DEFAULT_MODEL = "gpt-5.2-2025-12-11"  # Via Braintrust proxy custom provider "Eval"
+JUDGE_CONCURRENCY = 8  # Max judge calls in flight at once
+_FENCE_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)```', re.IGNORECASE)
+_JSON_DECODER = json.JSONDecoder()  # Stateless; shared by concurrent judge calls
+# Plan goal/overview (RAG search query) and ledger sections (learning context)
+_HEADING_RE = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+_OVERVIEW_RE = re.compile(r'Overview[:\s]*\n(.+?)(?:\n\n|\n#)', re.DOTALL)
+_GOAL_SECT_RE = re.compile(r'## Goal\n(.*?)(?=\n## |\Z)', re.DOTALL)
+_STATE_SECT_RE = re.compile(r'## State\n(.*?)(?=\n## |\Z)', re.DOTALL)
+JUDGE_TEMPERATURE = 0  # Verdicts are only cached at temperature 0 (deterministic)
+JUDGE_CACHE_VERSION = "1"  # Bump when prompt templates or verdict parsing change
+judge_cache_enabled = True  # --no-cache disables
+semantic_cache_enabled = True  # --no-semantic-cache (or --no-cache) disables
 
 # Critique-focused LLM-as-Judge prompts (binary pass/fail + gaps list)
 # Based on research: "Scores are theater, critiques are the product"
@@ -716,6 +1204,21 @@ HANDOFF_JUDGE_PROMPT = """You are reviewing a handoff document for completeness.
 
 PASS if all essential elements present. FAIL if any P0 gaps."""
 
+
+def split_template(template: str, field: str) -> tuple[str, str]:
+    """Split a one-field template into literal (brace-unescaped) prefix and suffix."""
+    prefix, suffix = template.split("{" + field + "}")
+    # .format() with no args unescapes {{ }} and fails loudly on a second field
+    return prefix.format(), suffix.format()
+
+
+# Templates with a single (possibly large) field: llm_judge joins the payload
+# between the literal halves instead of running str.format over it
+_SINGLE_SLOT_TEMPLATES = {
+    PLAN_JUDGE_PROMPT: ("content", *split_template(PLAN_JUDGE_PROMPT, "content")),
+    HANDOFF_JUDGE_PROMPT: ("content", *split_template(HANDOFF_JUDGE_PROMPT, "content")),
+}
+
 # New: Implementation review prompt (compares plan vs code diff)
 REVIEW_JUDGE_PROMPT = """You are verifying whether code changes implement a plan correctly.
 
@@ -755,78 +1258,224 @@ REVIEW_JUDGE_PROMPT = """You are verifying whether code changes implement a plan
 
 PASS if all P0 requirements DONE. FAIL if any P0 gap exists."""
 
+# Rerun of a review whose diff only grew: send just the new diff blocks
+REVIEW_DELTA_JUDGE_PROMPT = """You are re-verifying whether code changes implement a plan correctly.
+An earlier review covered most of the diff; only NEW changes since then are shown.
+
+**PLAN (Source of Truth):**
+{plan_content}
+
+**PREVIOUS VERDICT (for the earlier, unchanged part of the diff):**
+{previous_verdict}
+
+**NEW CODE CHANGES (since the previous review):**
+{diff_content}
+
+**SESSION CONTEXT (what tools were used):**
+{session_summary}
+
+**Instructions:**
+1. Start from the PREVIOUS VERDICT's gaps
+2. Drop gaps that the NEW CODE CHANGES resolve; keep the rest
+3. Add gaps introduced or left open by the NEW CODE CHANGES
+4. Mark as: DONE | PARTIAL | MISSING | DIVERGED
+
+**Focus on GAPS only - do not list correctly implemented items.**
+
+**Output JSON only (the complete updated verdict, not just the changes):**
+{{
+  "verdict": "PASS" | "FAIL",
+  "requirements_checked": {{"total": N, "done": N, "gaps": N}},
+  "gaps": [
+    {{
+      "id": "GAP-001",
+      "requirement": "what was expected",
+      "status": "MISSING|PARTIAL|DIVERGED",
+      "evidence": "file:line or 'not found'",
+      "severity": "P0|P1|P2",
+      "fix_action": "specific fix"
+    }}
+  ],
+  "scope_creep": ["items in diff but not in plan"],
+  "summary": "1 sentence verdict"
+}}
+
+PASS if all P0 requirements DONE. FAIL if any P0 gap exists."""
+
+
+_JUDGE_SESSION = None  # aiohttp.ClientSession shared by judge/proxy calls
+_JUDGE_SESSION_LOOP = None  # Event loop the session is bound to
+
+
+async def _get_session():
+    """Shared aiohttp session for proxy calls, created on first use.
+
+    Repeated judge calls reuse pooled TCP/TLS connections instead of
+    handshaking per call. A session is bound to its event loop, so a new one
+    is created if the running loop changed (e.g. a later asyncio.run).
+    """
+    global _JUDGE_SESSION, _JUDGE_SESSION_LOOP
+
+    loop = asyncio.get_running_loop()
+    if _JUDGE_SESSION is not None and not _JUDGE_SESSION.closed and _JUDGE_SESSION_LOOP is not loop:
+        # Left open by an earlier loop (no _closing_session); release its
+        # connector instead of dropping it for aiohttp to warn about
+        try:
+            await _JUDGE_SESSION.close()
+        except RuntimeError as e:  # e.g. its loop is already closed
+            print(f"  Warning: could not close previous judge session: {e}", file=sys.stderr)
+    if _JUDGE_SESSION is None or _JUDGE_SESSION.closed or _JUDGE_SESSION_LOOP is not loop:
+        _JUDGE_SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=256, limit_per_host=64, ttl_dns_cache=300),
+            # Long reasoning completions can run for minutes; only connect is tight
+            timeout=aiohttp.ClientTimeout(total=300, connect=10),
+        )
+        _JUDGE_SESSION_LOOP = loop
+    return _JUDGE_SESSION
+
+
+async def _close_session() -> None:
+    """Close the shared session (must run on the loop that created it)."""
+    global _JUDGE_SESSION, _JUDGE_SESSION_LOOP
+    if _JUDGE_SESSION is not None and not _JUDGE_SESSION.closed:
+        await _JUDGE_SESSION.close()
+    _JUDGE_SESSION = _JUDGE_SESSION_LOOP = None
+
+
+async def _closing_session(coro):
+    """Await coro, then close the shared session before the loop goes away."""
+    try:
+        return await coro
+    finally:
+        await _close_session()
+
+
+def _run(coro):
+    """Run coro to completion, or schedule it on an already-running loop.
+
+    From plain sync code (the CLI) this is asyncio.run, closing the shared
+    session on the way out. Inside a running loop (an embedding harness),
+    asyncio.run would raise, so a Task is returned for the caller to await
+    and the session stays open for the loop that owns it; main() itself
+    refuses to start on a running loop, since it reads results inline.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_closing_session(coro))
+    return loop.create_task(coro)
+
+
+def judge_cache_key(prompt: str, full_prompt: str) -> str:
+    """Content address for a judge verdict (template, model, settings, prompt)."""
+    material = (f"{JUDGE_CACHE_VERSION}|{DEFAULT_MODEL}|{JUDGE_TEMPERATURE}|"
+                f"{prompt[:64]}|{full_prompt}")
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def judge_cache_dir() -> Path:
+    """The project's .claude/cache/judge/ directory."""
+    project_dir = Path(os.environ.get("CLAUDE_PROJECT_DIR", os.getcwd()))
+    return project_dir / ".claude" / "cache" / "judge"
+
+
+def judge_cache_path(key: str) -> Path:
+    """Sharded cache file under judge_cache_dir()."""
+    return judge_cache_dir() / key[:2] / f"{key}.json"
+
+
+def judge_cache_get(key: str) -> dict | None:
+    """Return a cached verdict, if any."""
+    if not judge_cache_enabled or JUDGE_TEMPERATURE != 0:
+        return None
+    try:
+        return json_loads(judge_cache_path(key).read_bytes())
+    except (OSError, ValueError):
+        return None
+
+
+def judge_cache_put(key: str, result: dict) -> None:
+    """Store a parsed verdict atomically (tmp file + rename)."""
+    if not judge_cache_enabled or JUDGE_TEMPERATURE != 0:
+        return
+    atomic_write_bytes(judge_cache_path(key), json_dumps(result))
+
 
 async def llm_judge(prompt: str, **format_args) -> dict:
     """Run LLM-as-judge evaluation with custom prompt.
 
     Returns dict with verdict (PASS/FAIL), gaps list, and summary.
     """
-    import aiohttp
-
     api_key = os.environ.get("BRAINTRUST_API_KEY", "")
     if not api_key:
         return {"verdict": None, "error": "BRAINTRUST_API_KEY not set"}
 
-    # Format prompt with provided args
-    # GPT-5.2 has 400k context, no truncation needed
-    truncated_args = format_args
-    full_prompt = prompt.format(**truncated_args)
+    # Format prompt with provided args (GPT-5.2 has 400k context, no truncation)
+    single_slot = _SINGLE_SLOT_TEMPLATES.get(prompt)
+    if single_slot is not None and format_args.keys() == {single_slot[0]}:
+        field, prefix, suffix = single_slot
+        full_prompt = "".join((prefix, format_args[field], suffix))
+    else:
+        full_prompt = prompt.format(**format_args)
+
+    cache_key = judge_cache_key(prompt, full_prompt)
+    cached = await asyncio.to_thread(judge_cache_get, cache_key)
+    if cached is not None:
+        return cached
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.braintrust.dev/v1/proxy/chat/completions",
-                headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-                json={
-                    "model": DEFAULT_MODEL,
-                    "messages": [{"role": "user", "content": full_prompt}],
-                    "temperature": 0,
-                    "max_tokens": 16000  # GPT-5.2 has 128k max, uses reasoning tokens internally
-                }
-            ) as resp:
-                if resp.status != 200:
-                    error = await resp.text()
-                    return {"verdict": None, "error": f"API error: {error[:100]}"}
-                data = await resp.json()
-                if not data.get("choices"):
-                    return {"verdict": None, "error": f"No choices in response: {data}"}
-                response_text = data["choices"][0]["message"]["content"] or ""
-                finish_reason = data["choices"][0].get("finish_reason", "")
-                usage = data.get("usage", {})
-                if not response_text and finish_reason == "length":
-                    return {"verdict": None, "error": f"Empty response (finish_reason: length). Usage: {usage}. Model may need higher max_tokens."}
-
-                # Parse JSON from response (handle nested objects)
-                import re
-                # Strip markdown code fences if present (```json ... ``` or ```JSON ... ```)
-                if '```' in response_text:
-                    fence_match = re.search(r'```(?:json)?\s*([\s\S]*?)```', response_text, re.IGNORECASE)
-                    if fence_match:
-                        response_text = fence_match.group(1).strip()
-                # Find JSON object, handling nested braces
-                json_start = response_text.find('{')
-                if json_start >= 0:
-                    brace_count = 0
-                    json_end = json_start
-                    for i, c in enumerate(response_text[json_start:], json_start):
-                        if c == '{':
-                            brace_count += 1
-                        elif c == '}':
-                            brace_count -= 1
-                            if brace_count == 0:
-                                json_end = i + 1
-                                break
-                    try:
-                        result = json.loads(response_text[json_start:json_end])
-                        return {
-                            "verdict": result.get("verdict"),
-                            "gaps": result.get("gaps", []),
-                            "summary": result.get("summary", ""),
-                            "raw": result
-                        }
-                    except json.JSONDecodeError:
-                        pass
-                return {"verdict": None, "error": f"Could not parse judge response: {response_text[:200]}"}
+        session = await _get_session()
+        async with session.post(
+            "https://api.braintrust.dev/v1/proxy/chat/completions",
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            json={
+                "model": DEFAULT_MODEL,
+                "messages": [{"role": "user", "content": full_prompt}],
+                "temperature": JUDGE_TEMPERATURE,
+                "max_tokens": 16000  # GPT-5.2 has 128k max, uses reasoning tokens internally
+            }
+        ) as resp:
+            if resp.status != 200:
+                error = await resp.text()
+                return {"verdict": None, "error": f"API error: {error[:100]}"}
+            # The verdict is a JSON string inside the completion envelope, so
+            # it can't be parsed before the body is complete; decode the raw
+            # bytes once (orjson when available) instead of via resp.json()
+            data = json_loads(await resp.read())
+            if not data.get("choices"):
+                return {"verdict": None, "error": f"No choices in response: {data}"}
+            response_text = data["choices"][0]["message"]["content"] or ""
+            finish_reason = data["choices"][0].get("finish_reason", "")
+            usage = data.get("usage", {})
+            if not response_text and finish_reason == "length":
+                return {"verdict": None,
+                        "error": f"Empty response (finish_reason: length). Usage: {usage}. "
+                                 "Model may need higher max_tokens."}
+
+            # Parse JSON from response (handle nested objects)
+            # Strip markdown code fences if present (```json ... ``` or ```JSON ... ```)
+            if '```' in response_text:
+                fence_match = _FENCE_RE.search(response_text)
+                if fence_match:
+                    response_text = fence_match.group(1).strip()
+            # Decode the first JSON object; raw_decode stops at its end, so
+            # trailing prose is ignored and braces inside strings are handled
+            json_start = response_text.find('{')
+            if json_start >= 0:
+                try:
+                    result, _ = _JSON_DECODER.raw_decode(response_text, json_start)
+                    verdict = {
+                        "verdict": result.get("verdict"),
+                        "gaps": result.get("gaps", []),
+                        "summary": result.get("summary", ""),
+                        "raw": result
+                    }
+                    await asyncio.to_thread(judge_cache_put, cache_key, verdict)
+                    return verdict
+                except json.JSONDecodeError:
+                    pass
+            return {"verdict": None,
+                    "error": f"Could not parse judge response: {response_text[:200]}"}
     except Exception as e:
         return {"verdict": None, "error": str(e)[:100]}
 
@@ -841,19 +1490,92 @@ async def score_plan(plan_content: str) -> dict:
     return result
 
 
+DIFF_BLOCK_RE = re.compile(r"^(?=diff --git )", re.MULTILINE)
+REVIEW_DELTA_MIN_OVERLAP = 0.8  # Jaccard overlap of diff blocks needed to review a delta
+
+
+def split_diff_blocks(diff_content: str) -> list[str]:
+    """Split a git diff into per-file blocks (one per 'diff --git' header)."""
+    return [block for block in DIFF_BLOCK_RE.split(diff_content) if block]
+
+
+def delta_start(previous: list[str], current: list[str]) -> int | None:
+    """Index where new blocks begin if current only appends to previous.
+
+    Returns None unless current starts with exactly the previous blocks and
+    their Jaccard overlap is at least REVIEW_DELTA_MIN_OVERLAP (and something
+    new was added).
+    """
+    if not previous or len(current) <= len(previous) or current[:len(previous)] != previous:
+        return None
+    overlap = len(set(previous) & set(current)) / len(set(previous) | set(current))
+    return len(previous) if overlap >= REVIEW_DELTA_MIN_OVERLAP else None
+
+
+def review_session_path(plan_hash: str) -> Path:
+    """Last review of a plan: its diff block hashes and verdict."""
+    return judge_cache_dir() / "sessions" / f"{plan_hash}.json"
+
+
+def review_session_get(plan_hash: str) -> dict | None:
+    """Return the stored last review of a plan, if any."""
+    if not judge_cache_enabled:
+        return None
+    try:
+        return json_loads(review_session_path(plan_hash).read_bytes())
+    except (OSError, ValueError):
+        return None
+
+
+def review_session_put(plan_hash: str, block_hashes: list[str], verdict: dict) -> None:
+    """Remember a review's diff blocks and verdict (atomic write)."""
+    if not judge_cache_enabled:
+        return
+    atomic_write_bytes(review_session_path(plan_hash), json_dumps(
+        {"plan_hash": plan_hash, "blocks": block_hashes, "verdict": verdict}
+    ))
+
+
 async def review_implementation(plan_content: str, diff_content: str, session_summary: str) -> dict:
     """Review implementation by comparing plan (intent) vs code (reality).
 
     This is the key LLM-as-judge function - compares what was planned
     against what was actually implemented.
+
+    When the same plan was reviewed before and the diff has only grown by
+    appending new file blocks, just those blocks are sent along with the
+    previous verdict (REVIEW_DELTA_JUDGE_PROMPT).
     """
-    result = await llm_judge(
-        REVIEW_JUDGE_PROMPT,
-        plan_content=plan_content,
-        diff_content=diff_content,
-        session_summary=session_summary
-    )
+    plan_hash = hashlib.sha256(plan_content.encode()).hexdigest()
+    blocks = split_diff_blocks(diff_content)
+    block_hashes = [hashlib.sha256(block.encode()).hexdigest() for block in blocks]
+
+    previous = await asyncio.to_thread(review_session_get, plan_hash)
+    start = delta_start(previous["blocks"], block_hashes) if previous else None
+    if start is not None:
+        prev = previous["verdict"]
+        result = await llm_judge(
+            REVIEW_DELTA_JUDGE_PROMPT,
+            plan_content=plan_content,
+            previous_verdict=json.dumps(
+                {"verdict": prev.get("verdict"), "summary": prev.get("summary"),
+                 "gaps": prev.get("gaps", [])}, indent=2
+            ),
+            diff_content="".join(blocks[start:]),
+            session_summary=session_summary
+        )
+    else:
+        result = await llm_judge(
+            REVIEW_JUDGE_PROMPT,
+            plan_content=plan_content,
+            diff_content=diff_content,
+            session_summary=session_summary
+        )
+
+    if result.get("verdict"):
+        await asyncio.to_thread(review_session_put, plan_hash, block_hashes, result)
     result["scorer"] = "implementation_review"
+    result["delta_review"] = start is not None
     return result
 
 
@@ -885,28 +1607,147 @@ PASS if plan addresses patterns that caused past failures.
 FAIL if plan repeats mistakes from similar failed work."""
 
 
+# Semantic plan cache: near-duplicate plans (similar full text, same section
+# outline, same precedent) reuse an earlier PASS instead of calling the judge.
+# FAILs are never reused: a revised plan is exactly what must be re-judged
+PLAN_EMBED_DIM = 512
+PLAN_CACHE_MIN_SIMILARITY = 0.93
+PLAN_CACHE_TTL = 7 * 24 * 3600  # seconds
+PLAN_TOKEN_RE = re.compile(r"[a-z0-9_]+")
+PLAN_SECTION_RE = re.compile(r"^#{1,6}\s+(.+?)\s*$", re.MULTILINE)
+
+
+def embed_text(text: str) -> list[float]:
+    """Hashing-trick bag-of-words embedding, L2-normalized.
+
+    Cheap and dependency-free; good enough to spot near-identical plans.
+    """
+    return list(_embed_cached(text))
+
+
+@functools.lru_cache(maxsize=1024)
+def _embed_cached(text: str) -> tuple:
+    # Repeated judge runs in one process embed the same plan text; memoized
+    vec = [0.0] * PLAN_EMBED_DIM
+    for token in PLAN_TOKEN_RE.findall(text.lower()):
+        digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % PLAN_EMBED_DIM
+        vec[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = sum(v * v for v in vec) ** 0.5
+    return tuple(v / norm for v in vec) if norm else tuple(vec)
+
+
+# Handoff fields shown as precedent, in display order
+PRECEDENT_FIELDS = ("session_name", "task_number", "task_summary",
+                    "what_worked", "what_failed", "key_decisions")
+
+
+def format_precedent(handoffs: list) -> str:
+    """Format similar handoffs as precedent for the RAG judge prompt."""
+    return _format_precedent_cached(
+        tuple(tuple(h.get(f) for f in PRECEDENT_FIELDS) for h in handoffs)
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _format_precedent_cached(rows: tuple) -> str:
+    # Keyed on content, so an edited handoff never reuses a stale string
+    if not rows:
+        return "(No similar past work found)"
+    parts = []
+    for session_name, task_number, task_summary, what_worked, what_failed, key_decisions in rows:
+        parts.append(f"**{session_name}/task-{task_number}**")
+        parts.append(f"  Summary: {task_summary[:150]}")
+        if what_worked:
+            parts.append(f"  What worked: {what_worked[:150]}")
+        if what_failed:
+            parts.append(f"  What failed: {what_failed[:150]}")
+        if key_decisions:
+            parts.append(f"  Key decisions: {key_decisions[:100]}")
+        parts.append("")
+    return "\n".join(parts)
+
+
+def plan_outline_hash(plan_content: str) -> str:
+    """Hash of the plan's section headings, so added or removed sections never match."""
+    headings = "\n".join(h.lower() for h in PLAN_SECTION_RE.findall(plan_content))
+    return hashlib.sha256(headings.encode()).hexdigest()
+
+
+def ensure_plan_judge_cache(conn) -> None:
+    """Create the plan_judge_cache table in context.db if missing."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(plan_judge_cache)")}
+    if columns and "outline" not in columns:
+        # Rows from before full-plan embeddings aren't comparable; start over
+        conn.execute("DROP TABLE plan_judge_cache")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS plan_judge_cache (
+            id INTEGER PRIMARY KEY,
+            embedding TEXT NOT NULL,  -- JSON array (embed_text of the full plan)
+            outline TEXT NOT NULL,    -- plan_outline_hash
+            precedent TEXT NOT NULL,  -- JSON precedent counts the verdict was based on
+            verdict TEXT NOT NULL,    -- JSON llm_judge result (PASS only)
+            created_at REAL NOT NULL
+        )
+    """)
+
+
+def plan_cache_lookup(conn, embedding: list[float], outline: str,
+                      precedent: dict) -> tuple[dict, float] | None:
+    """Best cached verdict with the same outline and similarity >= PLAN_CACHE_MIN_SIMILARITY."""
+    ensure_plan_judge_cache(conn)
+    rows = conn.execute(
+        "SELECT embedding, verdict FROM plan_judge_cache"
+        " WHERE created_at > ? AND outline = ? AND precedent = ?",
+        (time.time() - PLAN_CACHE_TTL, outline, json.dumps(precedent, sort_keys=True))
+    ).fetchall()
+    best = None
+    for cached_embedding, verdict in rows:
+        similarity = sum(a * b for a, b in zip(embedding, json.loads(cached_embedding)))
+        if similarity >= PLAN_CACHE_MIN_SIMILARITY and (best is None or similarity > best[1]):
+            best = (verdict, similarity)
+    return (json.loads(best[0]), best[1]) if best else None
+
+
+def plan_cache_store(conn, embedding: list[float], outline: str, precedent: dict,
+                     verdict: dict) -> None:
+    """Remember a PASS verdict for later near-duplicate plans (FAILs are not kept)."""
+    if verdict.get("verdict") != "PASS":
+        return
+    ensure_plan_judge_cache(conn)
+    conn.execute(
+        "INSERT INTO plan_judge_cache (embedding, outline, precedent, verdict, created_at)"
+        " VALUES (?, ?, ?, ?, ?)",
+        (json.dumps(embedding), outline, json.dumps(precedent, sort_keys=True),
+         json.dumps(verdict), time.time())
+    )
+    conn.commit()
+
+
 async def judge_plan_with_context(plan_content: str, db_path: str = None) -> dict:
     """RAG-enhanced plan judging using Context Graph precedent.
 
     Queries similar handoffs to provide contextual critique based on
     what SUCCEEDED and what FAILED in similar past work.
     """
-    # Import context graph query functions
-    import sqlite3
-    scripts_dir = Path(__file__).parent
-    sys.path.insert(0, str(scripts_dir))
-    from artifact_query import search_handoffs, get_db_path
-
+    if search_handoffs_multi is None:
+        return {"verdict": None, "error": "Context Graph unavailable: artifact_query.py not found"}
     db = db_path or get_db_path()
-    if not Path(db).exists():
+    if not await asyncio.to_thread(Path(db).exists):
         return {"verdict": None, "error": f"Context Graph not found: {db}"}
 
-    conn = sqlite3.connect(db)
+    def db_call(fn, *args, **kwargs):
+        """Run fn(conn, ...) on its own connection (sqlite connections are per-thread)."""
+        conn = sqlite3.connect(db)
+        try:
+            return fn(conn, *args, **kwargs)
+        finally:
+            conn.close()
 
     # Extract goal/summary from plan for search
     # Look for first heading or Overview section
-    goal_match = re.search(r'^#\s+(.+)$', plan_content, re.MULTILINE)
-    overview_match = re.search(r'Overview[:\s]*\n(.+?)(?:\n\n|\n#)', plan_content, re.DOTALL)
+    goal_match = _HEADING_RE.search(plan_content)
+    overview_match = _OVERVIEW_RE.search(plan_content)
     search_query = goal_match.group(1) if goal_match else ""
     if overview_match:
         search_query += " " + overview_match.group(1)[:200]
@@ -914,32 +1755,31 @@ async def judge_plan_with_context(plan_content: str, db_path: str = None) -> dic
     if not search_query.strip():
         search_query = plan_content[:300]  # Fallback to first 300 chars
 
-    # Query similar handoffs
-    succeeded = search_handoffs(conn, search_query, outcome="SUCCEEDED", limit=3)
-    failed = search_handoffs(conn, search_query, outcome="FAILED", limit=2)
-    # Also check PARTIAL failures for cautionary patterns
-    partial_minus = search_handoffs(conn, search_query, outcome="PARTIAL_MINUS", limit=1)
-    failed.extend(partial_minus)
-
-    conn.close()
+    # Query similar handoffs (one statement, off the event loop);
+    # PARTIAL_MINUS is included for cautionary patterns
+    matches = await asyncio.to_thread(
+        db_call, search_handoffs_multi, search_query,
+        {"SUCCEEDED": 3, "FAILED": 2, "PARTIAL_MINUS": 1}
+    )
+    succeeded = matches["SUCCEEDED"]
+    failed = matches["FAILED"] + matches["PARTIAL_MINUS"]
+
+    precedent_found = {"succeeded": len(succeeded), "failed": len(failed)}
+    use_semantic_cache = semantic_cache_enabled and judge_cache_enabled
+    if use_semantic_cache:
+        # The whole plan is compared, not just the search query: a revision
+        # that keeps the title and overview must still be re-judged
+        embedding = embed_text(plan_content)
+        outline = plan_outline_hash(plan_content)
+        hit = await asyncio.to_thread(
+            db_call, plan_cache_lookup, embedding, outline, precedent_found
+        )
+        if hit:
+            result, similarity = hit
+            result["semantic_hit"] = round(similarity, 3)
+            return result
 
     # Format precedent for prompt
-    def format_precedent(handoffs: list) -> str:
-        if not handoffs:
-            return "(No similar past work found)"
-        parts = []
-        for h in handoffs:
-            parts.append(f"**{h['session_name']}/task-{h['task_number']}**")
-            parts.append(f"  Summary: {h['task_summary'][:150]}")
-            if h.get('what_worked'):
-                parts.append(f"  What worked: {h['what_worked'][:150]}")
-            if h.get('what_failed'):
-                parts.append(f"  What failed: {h['what_failed'][:150]}")
-            if h.get('key_decisions'):
-                parts.append(f"  Key decisions: {h['key_decisions'][:100]}")
-            parts.append("")
-        return "\n".join(parts)
-
     succeeded_precedent = format_precedent(succeeded)
     failed_precedent = format_precedent(failed)
 
@@ -951,10 +1791,12 @@ async def judge_plan_with_context(plan_content: str, db_path: str = None) -> dic
         failed_precedent=failed_precedent
     )
     result["scorer"] = "rag_enhanced_judge"
-    result["precedent_found"] = {
-        "succeeded": len(succeeded),
-        "failed": len(failed)
-    }
+    result["precedent_found"] = precedent_found
+
+    if use_semantic_cache:
+        await asyncio.to_thread(
+            db_call, plan_cache_store, embedding, outline, precedent_found, result
+        )
     return result
 
 
@@ -970,9 +1812,21 @@ async def run_scorers(project_dir: str, session_id: str) -> list[dict]:
     # Score plans (useful - can iterate before implementing)
     plans_dir = Path(project_dir) / "thoughts" / "shared" / "plans"
     if plans_dir.exists():
-        for plan_file in plans_dir.glob(f"{today}*.md"):
-            content = plan_file.read_text()
-            score = await score_plan(content)
+        plan_files = list(plans_dir.glob(f"{today}*.md"))
+        # Judge calls are independent; run them concurrently, bounded so a busy
+        # day doesn't trip Braintrust rate limits
+        sem = asyncio.Semaphore(JUDGE_CONCURRENCY)
+
+        async def score_file(plan_file: Path) -> dict:
+            async with sem:
+                content = await asyncio.to_thread(plan_file.read_text)
+                return await score_plan(content)
+
+        results = await asyncio.gather(*(score_file(pf) for pf in plan_files),
+                                       return_exceptions=True)
+        for plan_file, score in zip(plan_files, results):
+            if isinstance(score, Exception):
+                score = {"verdict": None, "error": str(score)[:100]}
             score["file"] = str(plan_file.relative_to(project_dir))
             scores.append(score)
 
@@ -984,28 +1838,69 @@ async def run_scorers(project_dir: str, session_id: str) -> list[dict]:
     return scores
 
 
+MAX_DIFF_BYTES = 256 * 1024  # Larger diffs are cut and summarized with --stat
+
+
+async def git_diff(project_dir: str) -> str:
+    """`git diff HEAD`, streamed and capped at MAX_DIFF_BYTES.
+
+    Past the cap the rest of the diff is never read; a `git diff --stat HEAD`
+    summary is appended after the first MAX_DIFF_BYTES so the reviewer still
+    sees every file touched.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        "git", "diff", "HEAD", "--",
+        cwd=project_dir,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    chunks = []
+    total = 0
+    truncated = False
+    while chunk := await proc.stdout.read(64 * 1024):
+        total += len(chunk)
+        if total > MAX_DIFF_BYTES:
+            # Keep the part of the crossing chunk that still fits
+            chunks.append(chunk[:MAX_DIFF_BYTES - (total - len(chunk))])
+            truncated = True
+            break
+        chunks.append(chunk)
+
+    if truncated:
+        # git may already have exited; killing a reaped pid makes asyncio warn
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+        chunks.append(b"\n... [diff truncated, showing --stat only]\n")
+        stat = await asyncio.create_subprocess_exec(
+            "git", "diff", "--stat", "HEAD",
+            cwd=project_dir,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stat_out, _ = await stat.communicate()
+        chunks.append(stat_out)
+    await proc.wait()
+
+    return b"".join(chunks).decode(errors="replace")
+
+
 async def run_implementation_review(project_dir: str, plan_path: str, session_id: str = None) -> dict:
     """Run implementation review comparing plan vs git diff vs session data.
 
     This is invoked by the review-agent, not auto-insights.
     """
-    import subprocess
-
     # Read plan
     plan_file = Path(project_dir) / plan_path
-    if not plan_file.exists():
+    if not await asyncio.to_thread(plan_file.exists):
         return {"error": f"Plan not found: {plan_path}"}
-    plan_content = plan_file.read_text()
+    plan_content = await asyncio.to_thread(plan_file.read_text)
 
     # Get git diff
     try:
-        diff_result = subprocess.run(
-            ["git", "diff", "HEAD"],
-            cwd=project_dir,
-            capture_output=True,
-            text=True
-        )
-        diff_content = diff_result.stdout or "(no uncommitted changes)"
+        diff_content = await git_diff(project_dir) or "(no uncommitted changes)"
     except Exception as e:
         diff_content = f"(could not get diff: {e})"
 
@@ -1040,12 +1935,88 @@ Be specific. Reference actual tool calls and outcomes.
 
 Output in markdown format (not JSON)."""
 
+# Split once so the (large) trace is spliced in without a str.format pass
+_LEARN_PREFIX, _LEARN_SUFFIX = split_template(LEARN_JUDGE_PROMPT, "formatted_trace")
+
+# Learn-trace spans projected to what the prompt uses: flat prefix keys,
+# no task outputs (SPAN_FIELDS shows only the message) where BTQL accepts
+# the CASE projection, plain output otherwise (see learn_spans_query)
+LEARN_SPANS_SQL = """
+    SELECT
+        span_id,
+        created,
+        span_attributes['type'] as span_type,
+        span_attributes['name'] as span_name,
+        metadata['agent_type'] as agent_type,
+        metadata['skill_name'] as skill_name,
+        metadata['tool_name'] as tool_name,
+        input,
+        {output} as output
+    FROM logs
+    WHERE root_span_id = :session_id
+      AND span_attributes['type'] IN ({types})
+    ORDER BY created {order}
+    LIMIT :limit
+"""
+LEARN_TASK_OUTPUT_SQL = "CASE WHEN span_attributes['type'] = 'task' THEN NULL ELSE output END"
+
+
+def learn_spans_query(types: str, order: str, trim: bool = True) -> str:
+    """LEARN_SPANS_SQL for span types in order; trim drops task outputs server-side."""
+    return LEARN_SPANS_SQL.format(types=types, order=order,
+                                  output=LEARN_TASK_OUTPUT_SQL if trim else "output")
 
-async def learn_from_session(project_id: str, api_key: str, session_id: str | None = None):
-    """Extract learnings from a session and save to .claude/cache/learnings/."""
+# A handoff longer than this already synthesizes the session, so --learn
+# sends a reduced trace: user messages plus first/last spans as anchors
+HANDOFF_SUFFICIENT_CHARS = 4000
+REDUCED_TRACE_SPANS = 30
+REDUCED_HEAD_SPANS = 5
+REDUCED_TAIL_SPANS = 10
+# The reduced trace is spot-check evidence next to the handoff, so it gets
+# its own small budget instead of the full-trace 200K one
+REDUCED_FIELD_CHARS = 1500
+REDUCED_CONTEXT_CHARS = 50_000
+
+
+async def fetch_reduced_trace(project_id: str, api_key: str, session_id: str,
+                              trim: bool = True) -> list[dict]:
+    """Task spans plus the first/last task or tool spans, oldest first (no llm bodies).
+
+    Raises BTQLError if a query fails (see learn_spans_query for trim).
+    """
+    params = {"session_id": session_id}
+    async with btql_session() as session:
+        tasks, head, tail = await asyncio.gather(
+            run_sql_async(session, project_id, learn_spans_query("'task'", "ASC", trim),
+                          api_key, params={**params, "limit": REDUCED_TRACE_SPANS},
+                          raise_errors=True),
+            run_sql_async(session, project_id, learn_spans_query("'task', 'tool'", "ASC", trim),
+                          api_key, params={**params, "limit": REDUCED_HEAD_SPANS},
+                          raise_errors=True),
+            run_sql_async(session, project_id, learn_spans_query("'task', 'tool'", "DESC", trim),
+                          api_key, params={**params, "limit": REDUCED_TAIL_SPANS},
+                          raise_errors=True),
+        )
+
+    # Anchors first, then fill the remaining budget with user messages
+    spans = {s["span_id"]: s for s in head + tail}
+    for s in tasks:
+        if len(spans) >= REDUCED_TRACE_SPANS:
+            break
+        spans.setdefault(s["span_id"], s)
+    return sorted(spans.values(), key=lambda s: s["created"])
+
+
+async def learn_from_session(project_id: str, api_key: str, session_id: str | None = None,
+                             force_full_trace: bool = False):
+    """Extract learnings from a session and save to .claude/cache/learnings/.
+
+    Sessions with a substantial handoff get a reduced trace unless
+    force_full_trace is set.
+    """
     project_dir = os.environ.get("CLAUDE_PROJECT_DIR", os.getcwd())
     learnings_dir = Path(project_dir) / ".claude" / "cache" / "learnings"
-    learnings_dir.mkdir(parents=True, exist_ok=True)
+    await asyncio.to_thread(learnings_dir.mkdir, parents=True, exist_ok=True)
 
     # Get session data (use provided ID or most recent)
     if not session_id:
@@ -1054,46 +2025,29 @@ async def learn_from_session(project_id: str, api_key: str, session_id: str | No
             FROM logs
             ORDER BY created DESC
             LIMIT 1
-        """, api_key)
+        """, api_key, cache=False)
         if not sessions:
             print("No sessions found")
             return
         session_id = sessions[0]["session_id"]
     elif len(session_id) < 36:
         # Handle partial session ID
-        sessions = run_sql(project_id, f"""
+        sessions = run_sql(project_id, """
             SELECT DISTINCT root_span_id
             FROM logs
-            WHERE root_span_id LIKE '{session_id}%'
+            WHERE root_span_id LIKE :prefix
             LIMIT 1
-        """, api_key)
+        """, api_key, params={"prefix": f"{session_id}%"})
         if sessions:
             session_id = sessions[0]["root_span_id"]
         else:
             print(f"Session not found: {session_id}")
             return
 
-    # Fetch full session trace (like fixed replay)
-    spans = run_sql(project_id, f"""
-        SELECT
-            created,
-            input,
-            output,
-            span_attributes,
-            metadata
-        FROM logs
-        WHERE root_span_id = '{session_id}'
-        ORDER BY created
-        LIMIT 200
-    """, api_key)
-
-    if not spans:
-        print(f"No data for session: {session_id}")
-        return
-
-    # Query Context Graph for handoff + ledger (hierarchical context)
+    # Query Context Graph for handoff + ledger (hierarchical context) first;
+    # it decides how much trace to fetch
     print(f"  Querying Context Graph for hierarchical context...")
-    hier_ctx = get_hierarchical_context(session_id)
+    hier_ctx = await asyncio.to_thread(get_hierarchical_context, session_id)
     handoff = hier_ctx.get("handoff")
     ledger = hier_ctx.get("ledger")
 
@@ -1102,43 +2056,70 @@ async def learn_from_session(project_id: str, api_key: str, session_id: str | No
     if ledger:
         print(f"  Found ledger: {ledger.get('session_name')}")
 
-    # Build hierarchical context string
-    hierarchical_lines = []
+    # Fetch the session trace (only span types with content, see SPAN_FIELDS)
+    reduced_trace = (not force_full_trace and handoff is not None
+                     and len(handoff.get("content") or "") > HANDOFF_SUFFICIENT_CHARS)
+
+    async def fetch_spans(trim: bool) -> list[dict]:
+        if reduced_trace:
+            return await fetch_reduced_trace(project_id, api_key, session_id, trim)
+        return run_sql(project_id, learn_spans_query("'llm', 'task', 'tool'", "ASC", trim),
+                       api_key, params={"session_id": session_id, "limit": 200},
+                       raise_errors=True)
+
+    # If BTQL rejects the CASE projection, fall back to plain output (remembered)
+    trim = btql_features().get("learn_case_projection") is not False
+    try:
+        try:
+            spans = await fetch_spans(trim)
+        except BTQLError:
+            if not trim:
+                raise
+            spans = await fetch_spans(False)
+            record_btql_feature("learn_case_projection", False)
+    except BTQLError as e:
+        print(f"SQL Error: {e}", file=sys.stderr)
+        return
+    if reduced_trace:
+        print(f"  Handoff covers the session: reduced trace ({len(spans)} spans, "
+              f"--force-full-trace for all)")
+
+    if not spans:
+        print(f"No data for session: {session_id}")
+        return
+
+    # Build hierarchical context and trace into one buffer (no intermediate
+    # strings); priority: Handoff (testimony) -> Ledger (goal) -> Traces (evidence)
+    ctx_buf = io.StringIO()
 
     # Priority 1: Handoff (Claude's synthesis of the session)
     if handoff and handoff.get("content"):
-        hierarchical_lines.append("# Session Handoff (Claude's Summary)")
-        hierarchical_lines.append("")
-        hierarchical_lines.append(handoff["content"][:20000])  # Cap at 20KB
-        hierarchical_lines.append("")
-        hierarchical_lines.append("---")
-        hierarchical_lines.append("")
+        ctx_buf.write("# Session Handoff (Claude's Summary)\n\n")
+        ctx_buf.write(handoff["content"][:20000])  # Cap at 20KB
+        ctx_buf.write("\n\n---\n\n")
 
     # Priority 2: Ledger (goal and context)
     if ledger and ledger.get("content"):
-        hierarchical_lines.append("# Session Goal & Context (from Ledger)")
-        hierarchical_lines.append("")
+        ctx_buf.write("# Session Goal & Context (from Ledger)\n\n")
         # Extract just Goal and State sections to keep it focused
         ledger_content = ledger["content"]
         # Try to extract just the relevant sections
-        goal_match = re.search(r'## Goal\n(.*?)(?=\n## |\Z)', ledger_content, re.DOTALL)
-        state_match = re.search(r'## State\n(.*?)(?=\n## |\Z)', ledger_content, re.DOTALL)
+        goal_match = _GOAL_SECT_RE.search(ledger_content)
+        state_match = _STATE_SECT_RE.search(ledger_content)
         if goal_match:
-            hierarchical_lines.append(f"## Goal\n{goal_match.group(1).strip()[:2000]}")
+            ctx_buf.write(f"## Goal\n{goal_match.group(1).strip()[:2000]}\n")
         if state_match:
-            hierarchical_lines.append(f"\n## State\n{state_match.group(1).strip()[:3000]}")
-        hierarchical_lines.append("")
-        hierarchical_lines.append("---")
-        hierarchical_lines.append("")
+            ctx_buf.write(f"\n## State\n{state_match.group(1).strip()[:3000]}\n")
+        ctx_buf.write("\n---\n\n")
 
-    hierarchical_context = "\n".join(hierarchical_lines)
-    hierarchical_chars = len(hierarchical_context)
+    hierarchical_chars = ctx_buf.tell()
     print(f"  Hierarchical context: {hierarchical_chars:,} chars")
 
     # Format trace for LLM with dynamic budget
-    trace_lines = []
-    trace_lines.append(f"# Session Trace: {session_id}")
-    trace_lines.append("")
+    ctx_buf.write(f"# Session Trace: {session_id}\n\n")
+    if reduced_trace:
+        ctx_buf.write("(Reduced trace: user messages and first/last tool calls; "
+                      "the handoff above summarizes the rest.)\n\n")
 
     # Dynamic budget calculation (accounting for hierarchical context)
     # Braintrust API disconnects above ~300K chars empirically (see learn.log)
@@ -1154,10 +2135,8 @@ async def learn_from_session(project_id: str, api_key: str, session_id: str | No
 
     def score_span(span: dict) -> int:
         """Score span by importance. Higher = more signal."""
-        span_attrs = span.get("span_attributes") or {}
-        metadata = span.get("metadata") or {}
-        span_type = span_attrs.get("type", "unknown")
-        tool_name = metadata.get("tool_name", "")
+        span_type = span.get("span_type") or "unknown"
+        tool_name = span.get("tool_name") or ""
 
         # Errors are always highest priority
         if span.get("error") or span.get("status") == "error":
@@ -1172,7 +2151,7 @@ async def learn_from_session(project_id: str, api_key: str, session_id: str | No
             return 70
 
         # Skills and agent outputs
-        if metadata.get("skill_name") or metadata.get("agent_type"):
+        if span.get("skill_name") or span.get("agent_type"):
             return 65
 
         # Other tools (moderate value)
@@ -1228,132 +2207,103 @@ async def learn_from_session(project_id: str, api_key: str, session_id: str | No
     estimated_fields = int(selected_count * 2.5)
     per_field_budget = AVAILABLE_CHARS // max(1, estimated_fields)
     per_field_budget = max(MIN_PER_FIELD, min(MAX_PER_FIELD, per_field_budget))
-
-    def clean(text: str, max_len: int = per_field_budget) -> str:
-        """Clean and truncate text for trace (dynamic budget based on span count)."""
-        if not text:
-            return ""
-        text = str(text).strip()
-        if len(text) > max_len:
-            return text[:max_len] + f"... [truncated {len(text) - max_len} chars]"
-        return text
+    if reduced_trace:
+        per_field_budget = REDUCED_FIELD_CHARS
 
     print(f"  Selected spans: {selected_count}, budget: {per_field_budget} chars/field")
 
     for i, s in selected_spans:
-        span_attrs = s.get("span_attributes") or {}
-        metadata = s.get("metadata") or {}
-        span_type = span_attrs.get("type", "unknown")
-        span_name = span_attrs.get("name", "unknown")
+        span_type = s.get("span_type") or "unknown"
+        span_name = s.get("span_name") or "unknown"
 
-        # Determine prefix
-        prefix = ""
-        if metadata.get("agent_type"):
-            prefix = f"[Agent:{metadata['agent_type']}] "
-        elif metadata.get("skill_name"):
-            prefix = f"[Skill:{metadata['skill_name']}] "
-        elif metadata.get("tool_name"):
-            prefix = f"[Tool:{metadata['tool_name']}] "
+        # Determine prefix (rows carry the metadata keys as columns)
+        prefix = span_prefix(s)
 
-        trace_lines.append(f"## {i}. {prefix}{span_name} ({span_type})")
+        ctx_buf.write(f"## {i}. {prefix}{span_name} ({span_type})\n")
 
-        # Add content based on span type
-        if span_type == "llm":
-            input_text = s.get("input")
-            output_text = s.get("output")
-            if input_text:
-                trace_lines.append(f"**Input:** {clean(input_text)}")
-            if output_text:
-                trace_lines.append(f"**Output:** {clean(output_text)}")
-        elif span_type == "task":
-            input_text = s.get("input")
-            if input_text:
-                trace_lines.append(f"**Message:** {clean(input_text)}")
-        elif span_type == "tool":
-            input_text = s.get("input")
-            output_text = s.get("output")
-            if input_text:
-                trace_lines.append(f"**Input:** {clean(input_text)}")
-            if output_text:
-                trace_lines.append(f"**Output:** {clean(output_text)}")
-
-        trace_lines.append("")
-
-    formatted_trace = "\n".join(trace_lines)
-
-    # Combine hierarchical context + traces
-    # Priority: Handoff (testimony) → Ledger (goal) → Traces (evidence)
-    if hierarchical_context:
-        full_session_context = hierarchical_context + "\n" + formatted_trace
-    else:
-        full_session_context = formatted_trace
+        # Add content based on span type (truncated to the per-field budget)
+        for label, field in SPAN_FIELDS.get(span_type, ()):
+            text = s.get(field)
+            if text:
+                ctx_buf.write(f"**{label}:** ")
+                write_clean(ctx_buf, text, per_field_budget)
+                ctx_buf.write("\n")
+
+        ctx_buf.write("\n")
+
+    full_session_context = ctx_buf.getvalue()
+    ctx_buf.close()
 
     # CRITICAL: Final length check - truncate if over budget
     # This catches the case where per-field budget * actual fields exceeds total budget
-    MAX_CONTEXT_CHARS = TOTAL_CHARS - RESERVE_CHARS
+    MAX_CONTEXT_CHARS = REDUCED_CONTEXT_CHARS if reduced_trace else TOTAL_CHARS - RESERVE_CHARS
     if len(full_session_context) > MAX_CONTEXT_CHARS:
+        original_chars = len(full_session_context)
         # Preserve hierarchical context (high value), truncate traces
-        if hierarchical_context:
-            max_trace_chars = MAX_CONTEXT_CHARS - hierarchical_chars - 100  # buffer
-            formatted_trace = formatted_trace[:max_trace_chars] + "\n\n[... trace truncated for length ...]"
-            full_session_context = hierarchical_context + "\n" + formatted_trace
+        if hierarchical_chars:
+            full_session_context = (full_session_context[:MAX_CONTEXT_CHARS - 100]  # buffer
+                                    + "\n\n[... trace truncated for length ...]")
         else:
-            full_session_context = full_session_context[:MAX_CONTEXT_CHARS] + "\n\n[... truncated for length ...]"
-        print(f"  WARNING: Context truncated from {len(formatted_trace):,} to {MAX_CONTEXT_CHARS:,} chars")
+            full_session_context = (full_session_context[:MAX_CONTEXT_CHARS]
+                                    + "\n\n[... truncated for length ...]")
+        print(f"  WARNING: Context truncated from {original_chars:,} "
+              f"to {MAX_CONTEXT_CHARS:,} chars")
+    trace_chars = len(full_session_context) - hierarchical_chars
 
     # Pass to LLM judge for learning extraction
     print(f"Extracting learnings from session {session_id}...")
 
     # Use llm_judge but with a learning extraction prompt
-    import aiohttp
-
     bt_api_key = os.environ.get("BRAINTRUST_API_KEY", "")
     if not bt_api_key:
         print("Error: BRAINTRUST_API_KEY not set")
         return
 
-    full_prompt = LEARN_JUDGE_PROMPT.format(formatted_trace=full_session_context)
-    print(f"  Context: {len(full_session_context):,} chars (hierarchical: {hierarchical_chars:,}, traces: {len(formatted_trace):,})")
+    full_prompt = "".join((_LEARN_PREFIX, full_session_context, _LEARN_SUFFIX))
+    print(f"  Context: {len(full_session_context):,} chars "
+          f"(hierarchical: {hierarchical_chars:,}, traces: {trace_chars:,})")
     print(f"  Prompt: {len(full_prompt):,} chars")
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.braintrust.dev/v1/proxy/chat/completions",
-                headers={"Authorization": f"Bearer {bt_api_key}", "Content-Type": "application/json"},
-                json={
-                    "model": DEFAULT_MODEL,
-                    "messages": [{"role": "user", "content": full_prompt}],
-                    "temperature": 0,
-                    "max_tokens": 16000
-                }
-            ) as resp:
-                if resp.status != 200:
-                    error = await resp.text()
-                    print(f"Error: API error: {error[:100]}")
-                    return
-                data = await resp.json()
-                if not data.get("choices"):
-                    print(f"Error: No choices in response")
-                    return
-                learnings_content = data["choices"][0]["message"]["content"] or ""
-
-                if not learnings_content:
-                    print("Error: Empty response from LLM")
-                    return
-
-                # Save to file
-                date_str = datetime.now().strftime("%Y-%m-%d")
-                filename = f"{date_str}_{session_id}.md"
-                output_path = learnings_dir / filename
-
-                with open(output_path, "w") as f:
-                    f.write(f"# Learnings from Session {session_id}\n\n")
-                    f.write(f"**Date:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-                    f.write(learnings_content)
-
-                print(f"Learnings saved to: {output_path}")
-                print("\n" + learnings_content)
+        session = await _get_session()
+        async with session.post(
+            "https://api.braintrust.dev/v1/proxy/chat/completions",
+            headers={"Authorization": f"Bearer {bt_api_key}", "Content-Type": "application/json"},
+            json={
+                "model": DEFAULT_MODEL,
+                "messages": [{"role": "user", "content": full_prompt}],
+                "temperature": 0,
+                "max_tokens": 16000
+            }
+        ) as resp:
+            if resp.status != 200:
+                error = await resp.text()
+                print(f"Error: API error: {error[:100]}")
+                return
+            data = json_loads(await resp.read())
+            if not data.get("choices"):
+                print(f"Error: No choices in response")
+                return
+            learnings_content = data["choices"][0]["message"]["content"] or ""
+
+            if not learnings_content:
+                print("Error: Empty response from LLM")
+                return
+
+            # Save to file
+            date_str = datetime.now().strftime("%Y-%m-%d")
+            filename = f"{date_str}_{session_id}.md"
+            output_path = learnings_dir / filename
+
+            await asyncio.to_thread(
+                output_path.write_text,
+                f"# Learnings from Session {session_id}\n\n"
+                f"**Date:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+                + learnings_content
+            )
+
+            print(f"Learnings saved to: {output_path}")
+            print("\n" + learnings_content)
 
     except Exception as e:
         print(f"Error: {str(e)[:100]}")
@@ -1393,6 +2343,13 @@ def parse_args():
                         help="Specific session ID for --learn or --review")
     parser.add_argument("--score", action="store_true",
                         help="Enable qualitative scoring (uses LLM-as-judge)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the on-disk query cache (~/.claude/bt_cache/) "
+                             "and judge verdict cache (.claude/cache/judge/)")
+    parser.add_argument("--no-semantic-cache", action="store_true",
+                        help="Always call the judge for --rag-judge, even for near-duplicate plans")
+    parser.add_argument("--force-full-trace", action="store_true",
+                        help="Send the full session trace for --learn even when a handoff exists")
 
     # Handle being called via runtime.harness
     args_to_parse = [arg for arg in sys.argv[1:] if not arg.endswith(".py")]
@@ -1400,7 +2357,23 @@ def parse_args():
 
 
 def main():
+    global sql_cache_enabled, judge_cache_enabled, semantic_cache_enabled
+
+    # The branches below consume _run() results synchronously, which only
+    # holds outside a loop; async callers should await the coroutines.
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        raise RuntimeError(
+            "main() is the CLI entry point and cannot run inside an event loop; "
+            "await weekly_summary(), run_implementation_review() etc. directly"
+        )
+
     args = parse_args()
+    sql_cache_enabled = judge_cache_enabled = not args.no_cache
+    semantic_cache_enabled = not args.no_semantic_cache
     api_key = load_api_key()
     project_id = get_project_id(args.project, api_key)
 
@@ -1417,16 +2390,14 @@ def main():
     elif args.replay:
         replay_session(project_id, api_key, args.replay)
     elif args.weekly_summary:
-        weekly_summary(project_id, api_key)
+        _run(weekly_summary(project_id, api_key))
     elif args.token_trends:
-        token_trends(project_id, api_key)
+        _run(token_trends(project_id, api_key))
     elif args.learn:
-        import asyncio
-        asyncio.run(learn_from_session(project_id, api_key, args.session_id))
+        _run(learn_from_session(project_id, api_key, args.session_id, args.force_full_trace))
     elif args.review:
-        import asyncio
         project_dir = os.environ.get("CLAUDE_PROJECT_DIR", os.getcwd())
-        result = asyncio.run(run_implementation_review(project_dir, args.review, args.session_id))
+        result = _run(run_implementation_review(project_dir, args.review, args.session_id))
 
         # Print review results
         if result.get("error"):
@@ -1439,6 +2410,8 @@ def main():
 
         print(f"\n## Implementation Review")
         print(f"**Plan:** {result.get('plan_file', 'unknown')}")
+        if result.get("delta_review"):
+            print("**Mode:** Delta (only diff blocks added since the last review)")
         print(f"**Verdict:** {verdict}")
         print(f"**Gaps:** {len(gaps)} total ({len(p0_gaps)} blocking)")
 
@@ -1469,7 +2442,6 @@ def main():
             print(f"\n**Ready for:** Handoff creation")
 
     elif args.rag_judge:
-        import asyncio
         project_dir = os.environ.get("CLAUDE_PROJECT_DIR", os.getcwd())
         plan_file = Path(project_dir) / args.rag_judge
         if not plan_file.exists():
@@ -1478,7 +2450,7 @@ def main():
 
         plan_content = plan_file.read_text()
         db_path = Path(project_dir) / ".claude" / "cache" / "artifact-index" / "context.db"
-        result = asyncio.run(judge_plan_with_context(plan_content, str(db_path)))
+        result = _run(judge_plan_with_context(plan_content, str(db_path)))
 
         # Print results
         if result.get("error"):
@@ -1495,7 +2467,11 @@ def main():
         output_lines.append("## RAG-Enhanced Plan Review")
         output_lines.append(f"**Plan:** {args.rag_judge}")
         output_lines.append(f"**Verdict:** {verdict}")
-        output_lines.append(f"**Precedent used:** {precedent.get('succeeded', 0)} succeeded, {precedent.get('failed', 0)} failed")
+        output_lines.append(f"**Precedent used:** {precedent.get('succeeded', 0)} succeeded, "
+                            f"{precedent.get('failed', 0)} failed")
+        if result.get("semantic_hit"):
+            output_lines.append("**Cached:** Reused verdict of a near-identical plan "
+                                f"(similarity {result['semantic_hit']})")
 
         if result.get("summary"):
             output_lines.append(f"\n**Summary:** {result['summary']}")
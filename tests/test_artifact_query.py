@@ -10,6 +10,7 @@ import json
 import sqlite3
 import subprocess
 import sys
+import tempfile
 from pathlib import Path
 from unittest import TestCase, main
 
@@ -175,6 +176,19 @@ class TestQueryFunctions(TestCase):
         results = search_handoffs(self.conn, "API", limit=1)
         self.assertEqual(len(results), 1)
 
+    def test_search_handoffs_multi_matches_single(self):
+        """Test batched outcome search returns the same rows as per-outcome calls."""
+        from artifact_query import search_handoffs, search_handoffs_multi
+        buckets = {"SUCCEEDED": 3, "FAILED": 2, "PARTIAL_MINUS": 1}
+        results = search_handoffs_multi(self.conn, "authentication migration", buckets)
+        self.assertEqual(list(results), list(buckets))
+        for outcome, limit in buckets.items():
+            single = search_handoffs(self.conn, "authentication migration",
+                                     outcome=outcome, limit=limit)
+            self.assertEqual(results[outcome], single)
+        self.assertEqual(results["PARTIAL_MINUS"], [])
+        self.assertEqual(search_handoffs_multi(self.conn, "OAuth", {}), {})
+
     def test_search_handoffs_returns_all_fields(self):
         """Test that handoff search returns all expected fields."""
         from artifact_query import search_handoffs
@@ -250,6 +264,63 @@ class TestQueryFunctions(TestCase):
         self.assertEqual(len(results), 0)
 
 
+class TestQueryBySpanId(TestCase):
+    """Test in-process handoff lookup by Braintrust root_span_id."""
+
+    def setUp(self):
+        """Create a project dir with an indexed handoff and its ledger."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base = Path(self.tmp.name)
+
+        db_path = self.base / ".claude" / "cache" / "artifact-index" / "context.db"
+        db_path.parent.mkdir(parents=True)
+        conn = sqlite3.connect(db_path)
+        schema_path = Path(__file__).parent.parent / "scripts" / "artifact_schema.sql"
+        conn.executescript(schema_path.read_text())
+        conn.execute("""
+            INSERT INTO handoffs (id, session_name, task_number, file_path, task_summary,
+                                  outcome, root_span_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            "handoff001", "auth-session", 1, "thoughts/shared/handoffs/auth-session/task-01.md",
+            "Implemented OAuth2", "SUCCEEDED", "span-123"
+        ))
+        conn.commit()
+        conn.close()
+
+        handoff_dir = self.base / "thoughts" / "shared" / "handoffs" / "auth-session"
+        handoff_file = handoff_dir / "task-01.md"
+        handoff_file.parent.mkdir(parents=True)
+        handoff_file.write_text("# Handoff content")
+        (self.base / "CONTINUITY_CLAUDE-auth-session.md").write_text("## Goal\nShip auth")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_query_by_span_id_with_content(self):
+        """Test handoff content and ledger are resolved relative to base_dir."""
+        from artifact_query import query_by_span_id
+        handoff = query_by_span_id("span-123", with_content=True, base_dir=self.base)
+        self.assertEqual(handoff["id"], "handoff001")
+        self.assertEqual(handoff["content"], "# Handoff content")
+        self.assertEqual(handoff["ledger"]["session_name"], "auth-session")
+        self.assertIn("Ship auth", handoff["ledger"]["content"])
+
+    def test_query_by_span_id_without_content(self):
+        """Test metadata-only lookup skips file reads."""
+        from artifact_query import query_by_span_id
+        handoff = query_by_span_id("span-123", base_dir=self.base)
+        self.assertEqual(handoff["session_name"], "auth-session")
+        self.assertNotIn("content", handoff)
+        self.assertNotIn("ledger", handoff)
+
+    def test_query_by_span_id_not_found(self):
+        """Test unknown span IDs and missing databases return None."""
+        from artifact_query import query_by_span_id
+        self.assertIsNone(query_by_span_id("missing", base_dir=self.base))
+        self.assertIsNone(query_by_span_id("span-123", base_dir=self.base / "nowhere"))
+
+
 class TestFormatResults(TestCase):
     """Test result formatting."""
 
@@ -0,0 +1,905 @@
+#!/usr/bin/env python3
+"""
+Tests for braintrust_analyze.py - BTQL client, caches, judges and reviews.
+
+No real network traffic: BTQL and judge calls (run_sql, run_sql_async,
+run_sql_columns, llm_judge, learn_from_session) run against fake HTTP
+sessions, covering the response/project caches, stale-project retries and
+BTQL feature fallbacks. Also covered: query building, daily rollups, the
+judge and semantic plan caches, and git_diff against a throwaway repo.
+"""
+
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stderr, redirect_stdout
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase, main
+from unittest.mock import patch
+
+# Add scripts to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "scripts"))
+
+
+class TestQueryBuilding(TestCase):
+    """Test project scoping and parameter binding."""
+
+    def test_scope_query(self):
+        """Test FROM logs is rewritten to the project-scoped source."""
+        from braintrust_analyze import scope_query
+        query = scope_query("proj-1", "SELECT * FROM logs WHERE x = 1")
+        self.assertEqual(query, "SELECT * FROM project_logs('proj-1') WHERE x = 1")
+
+    def test_scope_query_case_insensitive(self):
+        """Test mixed case and extra whitespace are still scoped."""
+        from braintrust_analyze import scope_query
+        query = scope_query("proj-1", "SELECT * from   LOGS")
+        self.assertIn("project_logs('proj-1')", query)
+
+    def test_bind_params(self):
+        """Test placeholders are replaced with typed literals."""
+        from braintrust_analyze import bind_params
+        query = bind_params(
+            "WHERE root_span_id = :session_id AND created > :since LIMIT :limit",
+            {"session_id": "abc", "since": "2025-01-01T00:00:00Z", "limit": 5}
+        )
+        self.assertEqual(
+            query,
+            "WHERE root_span_id = 'abc' AND created > '2025-01-01T00:00:00Z' LIMIT 5"
+        )
+
+    def test_bind_params_escapes_quotes(self):
+        """Test caller-supplied strings can't break out of their literal."""
+        from braintrust_analyze import bind_params
+        query = bind_params("WHERE id = :id", {"id": "x' OR '1'='1"})
+        self.assertEqual(query, "WHERE id = 'x'' OR ''1''=''1'")
+
+    def test_bind_params_without_params(self):
+        """Test queries without params pass through untouched."""
+        from braintrust_analyze import bind_params
+        self.assertEqual(bind_params("SELECT :a", None), "SELECT :a")
+
+    def test_bind_params_missing_param(self):
+        """Test an unbound placeholder is an error, not a silent literal."""
+        from braintrust_analyze import bind_params
+        with self.assertRaises(KeyError):
+            bind_params("WHERE id = :id", {"other": 1})
+
+
+class FakeBTQLResponse:
+    """aiohttp response stand-in with a fixed status and body."""
+
+    def __init__(self, status: int, body: bytes = b""):
+        self.status = status
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def read(self):
+        return self.body
+
+    async def text(self):
+        return self.body.decode()
+
+
+class FakeBTQLSession:
+    """Replays queued responses and records the posted BTQL requests."""
+
+    def __init__(self, *responses: FakeBTQLResponse):
+        self.responses = list(responses)
+        self.requests = []
+
+    def post(self, url, headers=None, json=None):
+        self.requests.append(json)
+        return self.responses.pop(0)
+
+
+class TestBTQLClient(TestCase):
+    """Test the response cache and stale-project retry around BTQL calls."""
+
+    def setUp(self):
+        import braintrust_analyze as ba
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        for name, value in (("SQL_CACHE_DIR", Path(self.temp_dir.name)),
+                            ("PROJECT_CACHE_FILE", Path(self.temp_dir.name) / "projects.json"),
+                            ("sql_cache_enabled", True)):
+            patcher = patch.object(ba, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for memoized in (ba.get_project_id, ba.refresh_project_id):
+            memoized.cache_clear()
+            self.addCleanup(memoized.cache_clear)
+
+    def test_refresh_project_id(self):
+        """Test a stale cached ID is re-resolved by name and the cache rewritten."""
+        import braintrust_analyze as ba
+        other = ba.project_cache_key("agentica", "other-key")
+        ba.write_project_cache({ba.project_cache_key("agentica", "k"): "stale", other: "theirs"})
+        with patch.object(ba, "lookup_project_id", return_value="fresh") as lookup:
+            self.assertEqual(ba.refresh_project_id("stale", "k"), "fresh")
+            self.assertEqual(ba.refresh_project_id("stale", "k"), "fresh")
+        lookup.assert_called_once_with("agentica", "k")
+        self.assertEqual(ba.read_project_cache(),
+                         {other: "theirs", ba.project_cache_key("agentica", "k"): "fresh"})
+        self.assertIsNone(ba.refresh_project_id("never-cached", "k"))
+        self.assertIsNone(ba.refresh_project_id("theirs", "k"))
+
+    def test_project_cache_per_api_key(self):
+        """Test a project name cached under one org's key isn't reused for another's."""
+        import braintrust_analyze as ba
+        with patch.object(ba, "lookup_project_id", side_effect=["org-a", "org-b"]) as lookup:
+            self.assertEqual(ba.get_project_id("agentica", "key-a"), "org-a")
+            self.assertEqual(ba.get_project_id("agentica", "key-b"), "org-b")
+            ba.get_project_id.cache_clear()
+            self.assertEqual(ba.get_project_id("agentica", "key-a"), "org-a")
+        self.assertEqual(lookup.call_count, 2)
+        self.assertNotIn("key-a", ba.PROJECT_CACHE_FILE.read_text())
+
+    def test_sql_cache_ttl(self):
+        """Test cached rows are served until SQL_CACHE_TTL passes, then refetched."""
+        import braintrust_analyze as ba
+        with patch.object(ba.time, "time", return_value=1000.0):
+            ba.sql_cache_put("p", "SELECT 1", [{"n": 1}])
+        with patch.object(ba.time, "time", return_value=1000.0 + ba.SQL_CACHE_TTL):
+            self.assertEqual(ba.sql_cache_get("p", "SELECT 1"), [{"n": 1}])
+        with patch.object(ba.time, "time", return_value=1001.0 + ba.SQL_CACHE_TTL):
+            self.assertIsNone(ba.sql_cache_get("p", "SELECT 1"))
+        self.assertIsNone(ba.sql_cache_get("other", "SELECT 1"))
+
+    def test_sql_cache_disabled(self):
+        """Test --no-cache bypasses both reads and writes."""
+        import braintrust_analyze as ba
+        ba.sql_cache_put("p", "SELECT 1", [{"n": 1}])
+        with patch.object(ba, "sql_cache_enabled", False):
+            self.assertIsNone(ba.sql_cache_get("p", "SELECT 1"))
+            ba.sql_cache_put("p", "SELECT 2", [{"n": 2}])
+        self.assertIsNone(ba.sql_cache_get("p", "SELECT 2"))
+
+    def test_run_sql_uncached(self):
+        """Test cache=False always hits BTQL and leaves the cache untouched."""
+        import braintrust_analyze as ba
+        calls = []
+
+        def post(url, headers=None, json=None):
+            calls.append(json["query"])
+            return SimpleNamespace(status_code=200, content=b'{"data": [{"n": 2}]}')
+
+        ba.sql_cache_put("p", "SELECT 1", [{"n": 1}])
+        with patch.object(ba, "http_session", return_value=SimpleNamespace(post=post)):
+            self.assertEqual(ba.run_sql("p", "SELECT 1", "k", cache=False), [{"n": 2}])
+            self.assertEqual(ba.run_sql("p", "SELECT 2", "k", cache=False), [{"n": 2}])
+            self.assertEqual(ba.run_sql("p", "SELECT 1", "k"), [{"n": 1}])
+        self.assertEqual(len(calls), 2)
+        self.assertIsNone(ba.sql_cache_get("p", "SELECT 2"))
+
+    def test_stale_project_retry(self):
+        """Test a 404/401/403 is retried once under the re-resolved project."""
+        import braintrust_analyze as ba
+        for status in (404, 401, 403):
+            with self.subTest(status=status):
+                session = FakeBTQLSession(FakeBTQLResponse(status, b"denied"),
+                                          FakeBTQLResponse(200, b'{"data": [{"n": 1}]}'))
+                with patch.object(ba, "refresh_project_id", return_value="fresh") as refresh:
+                    rows = asyncio.run(ba.run_sql_async(session, "stale",
+                                                        f"SELECT {status} FROM logs", "k"))
+                self.assertEqual(rows, [{"n": 1}])
+                refresh.assert_called_once_with("stale", "k")
+                self.assertIn("project_logs('fresh')", session.requests[1]["query"])
+
+    @staticmethod
+    def fake_parquet(columns: dict):
+        """pyarrow.parquet stand-in whose tables decode to columns."""
+        table = SimpleNamespace(to_pydict=lambda: columns)
+        return SimpleNamespace(read_table=lambda source: table)
+
+    def test_columns_parquet_cached(self):
+        """Test a Parquet result is cached like JSON rows."""
+        import braintrust_analyze as ba
+        session = FakeBTQLSession(FakeBTQLResponse(200, b"parquet"))
+        parquet = self.fake_parquet({"day": ["2025-01-01"], "sessions": [2]})
+        with patch.object(ba, "pq", parquet):
+            first = asyncio.run(ba.run_sql_columns(session, "p", "SELECT 1", "k"))
+            second = asyncio.run(ba.run_sql_columns(session, "p", "SELECT 1", "k"))
+        self.assertEqual(first, {"day": ["2025-01-01"], "sessions": [2]})
+        self.assertEqual(second, first)
+        self.assertEqual(len(session.requests), 1)
+        self.assertEqual(session.requests[0]["fmt"], "parquet")
+
+    def test_columns_parquet_timestamps(self):
+        """Test Parquet datetimes come back as ISO strings the rollup can slice."""
+        import braintrust_analyze as ba
+        created = [datetime(2025, 1, 1, 9, tzinfo=timezone.utc),
+                   datetime(2025, 1, 2, 9, tzinfo=timezone.utc)]
+        session = FakeBTQLSession(FakeBTQLResponse(200, b"parquet"))
+        parquet = self.fake_parquet({"created": created, "root_span_id": ["a", "b"],
+                                     "tokens": [1, 2]})
+        with patch.object(ba, "pq", parquet):
+            columns = asyncio.run(ba.run_sql_columns(session, "p", "SELECT 1", "k"))
+        self.assertEqual(columns["created"][0], "2025-01-01T09:00:00+00:00")
+        self.assertEqual(ba.sql_cache_get("p", "SELECT 1\0columns"), columns)
+        with patch.object(ba, "np", None):
+            daily = ba.aggregate_daily(columns["created"], columns["root_span_id"],
+                                       columns["tokens"], "tokens")
+        self.assertEqual([d["day"] for d in daily], ["2025-01-01", "2025-01-02"])
+
+    def test_columns_stale_project_retry(self):
+        """Test a 404 on the Parquet path re-resolves the project once."""
+        import braintrust_analyze as ba
+        session = FakeBTQLSession(FakeBTQLResponse(404, b"missing"),
+                                  FakeBTQLResponse(200, b"parquet"))
+        with patch.object(ba, "pq", self.fake_parquet({"x": [1]})), \
+                patch.object(ba, "refresh_project_id", return_value="fresh"):
+            columns = asyncio.run(ba.run_sql_columns(session, "stale", "SELECT * FROM logs", "k"))
+        self.assertEqual(columns, {"x": [1]})
+        self.assertIn("project_logs('fresh')", session.requests[1]["query"])
+
+
+class TestReplay(TestCase):
+    """Test replay_session's partial-ID handling and BTQL fallbacks."""
+
+    def setUp(self):
+        import braintrust_analyze as ba
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        patcher = patch.object(ba, "SQL_CACHE_DIR", Path(self.temp_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ba.btql_features.cache_clear()
+        self.addCleanup(ba.btql_features.cache_clear)
+
+    def replay(self, session_id: str, rows: list, rejected: str = "") -> tuple[str, list]:
+        """Replay against canned rows; queries containing rejected raise BTQLError."""
+        import braintrust_analyze as ba
+        queries = []
+
+        def fake_iter(project_id, query, api_key, params=None, **kwargs):
+            queries.append(query)
+            if rejected and rejected in query:
+                raise ba.BTQLError("400 - unsupported")
+            yield from rows
+
+        out = io.StringIO()
+        with patch.object(ba, "run_sql_iter", fake_iter), redirect_stdout(out):
+            ba.replay_session("p", "k", session_id)
+        return out.getvalue(), queries
+
+    def test_ambiguous_prefix_reported(self):
+        """Test one session is replayed and the other matches are noted, not dropped."""
+        rows = [{"root_span_id": f"{root}-0000", "created": str(i),
+                 "span_attributes": {"type": "tool", "name": f"{root}{i}"}, "metadata": {}}
+                for root in ("abc1", "abc2") for i in range(2)]
+        out, queries = self.replay("abc", rows)
+        self.assertIn("ORDER BY root_span_id, created", queries[0])
+        self.assertIn("abc10", out)
+        self.assertNotIn("abc20", out)
+        self.assertIn("also matches other sessions (2 of their spans skipped)", out)
+
+    def test_unique_prefix_has_no_note(self):
+        """Test an unambiguous prefix replays without the note."""
+        rows = [{"root_span_id": "abc1-0000", "created": "1",
+                 "span_attributes": {"type": "tool", "name": "only"}, "metadata": {}}]
+        out, _ = self.replay("abc", rows)
+        self.assertIn("only", out)
+        self.assertNotIn("Note:", out)
+
+    def test_substring_rejected_falls_back(self):
+        """Test a rejected SUBSTRING query retries with full fields and is remembered."""
+        import braintrust_analyze as ba
+        rows = [{"root_span_id": "abc1-0000", "created": "1", "input": "  hello  ",
+                 "span_attributes": {"type": "tool", "name": "only"}, "metadata": {}}]
+        out, queries = self.replay("abc", rows, rejected="SUBSTRING")
+        self.assertEqual(len(queries), 2)
+        self.assertIn("Input: hello", out)
+        self.assertNotIn("not found", out)
+        self.assertIs(ba.btql_features()["replay_substring"], False)
+
+        _, queries = self.replay("abc", rows, rejected="SUBSTRING")
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("SUBSTRING", queries[0])
+
+    def test_error_is_not_reported_as_missing(self):
+        """Test a query BTQL rejects outright is reported as an error."""
+        err = io.StringIO()
+        with redirect_stderr(err):
+            out, _ = self.replay("abc", [], rejected="FROM logs")
+        self.assertNotIn("not found", out)
+        self.assertIn("SQL Error: 400 - unsupported", err.getvalue())
+
+
+class TestContextGraphOptional(TestCase):
+    """Test subcommands survive a missing artifact_query.py."""
+
+    def test_import_without_artifact_query(self):
+        """Test the script imports on its own and the lookups degrade to nothing."""
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        script = Path(__file__).parent.parent / "scripts" / "braintrust_analyze.py"
+        (Path(temp_dir.name) / script.name).write_text(script.read_text())
+        check = ("import braintrust_analyze as ba, asyncio;"
+                 "print(ba.get_hierarchical_context('s'));"
+                 "print(asyncio.run(ba.judge_plan_with_context('# Plan'))['error'])")
+        result = subprocess.run([sys.executable, "-c", check], cwd=temp_dir.name,
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("{'handoff': None, 'ledger': None}", result.stdout)
+        self.assertIn("Context Graph unavailable", result.stdout)
+
+
+class TestFormatting(TestCase):
+    """Test span formatting helpers."""
+
+    def test_span_prefix_priority(self):
+        """Test agent beats skill beats tool, and empty values are skipped."""
+        from braintrust_analyze import span_prefix
+        self.assertEqual(
+            span_prefix({"agent_type": "plan", "skill_name": "s", "tool_name": "Bash"}),
+            "[Agent:plan] "
+        )
+        self.assertEqual(span_prefix({"agent_type": "", "tool_name": "Bash"}), "[Tool:Bash] ")
+        self.assertEqual(span_prefix({}), "")
+
+    def test_format_precedent(self):
+        """Test precedent text tracks handoff content, not just identity."""
+        from braintrust_analyze import format_precedent
+        handoff = {"id": "h1", "session_name": "auth", "task_number": 1,
+                   "task_summary": "Added OAuth", "what_worked": "passport.js",
+                   "what_failed": "", "key_decisions": None}
+        text = format_precedent([handoff])
+        self.assertIn("**auth/task-1**", text)
+        self.assertIn("What worked: passport.js", text)
+        self.assertNotIn("What failed", text)
+        edited = format_precedent([dict(handoff, what_failed="cookies")])
+        self.assertIn("What failed: cookies", edited)
+        self.assertEqual(format_precedent([]), "(No similar past work found)")
+
+
+class TestAggregation(TestCase):
+    """Test client-side fallback aggregation."""
+
+    def test_aggregate_daily(self):
+        """Test distinct sessions and summed values per day."""
+        from braintrust_analyze import aggregate_daily
+        daily = aggregate_daily(
+            ["2025-01-01T01:00:00Z", "2025-01-01T02:00:00Z", "2025-01-02T00:00:00Z"],
+            ["s1", "s1", "s2"],
+            [1, 2, 3],
+            "tool_calls"
+        )
+        self.assertEqual(daily, [
+            {"day": "2025-01-01", "sessions": 1, "tool_calls": 3},
+            {"day": "2025-01-02", "sessions": 1, "tool_calls": 3},
+        ])
+
+    def test_aggregate_daily_empty(self):
+        """Test no rows yields no days."""
+        from braintrust_analyze import aggregate_daily
+        self.assertEqual(aggregate_daily([], [], [], "tokens"), [])
+
+    def test_aggregate_daily_numpy_matches_python(self):
+        """Test the vectorized (and numba, if installed) paths agree with pure Python."""
+        import braintrust_analyze
+        if braintrust_analyze.np is None:
+            self.skipTest("numpy not installed")
+
+        created = [f"2025-01-0{1 + i % 3}T00:00:{i % 60:02d}Z" for i in range(50)]
+        session_ids = [f"s{i % 7}" for i in range(50)]
+        values = [i % 4 for i in range(50)]
+
+        vectorized = braintrust_analyze.aggregate_daily(created, session_ids, values, "v")
+        with patch.object(braintrust_analyze, "njit", None):
+            numpy_only = braintrust_analyze.aggregate_daily(created, session_ids, values, "v")
+        with patch.object(braintrust_analyze, "np", None):
+            pure = braintrust_analyze.aggregate_daily(created, session_ids, values, "v")
+        self.assertEqual(vectorized, pure)
+        self.assertEqual(numpy_only, pure)
+
+
+class TestDailyRollup(TestCase):
+    """Test the approx -> exact -> client-side fallback chain of daily_rollup."""
+
+    def setUp(self):
+        import braintrust_analyze as ba
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        patcher = patch.object(ba, "SQL_CACHE_DIR", Path(self.temp_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ba.btql_features.cache_clear()
+        self.addCleanup(ba.btql_features.cache_clear)
+
+    def rollup(self, rejected: tuple) -> tuple[list, list]:
+        """Run daily_rollup with queries containing any rejected marker failing."""
+        import braintrust_analyze as ba
+        queries = []
+
+        async def fake_sql(session, project_id, query, api_key, params=None, **kwargs):
+            queries.append(query)
+            if any(marker in query for marker in rejected):
+                raise ba.BTQLError("400 - unsupported")
+            return [{"day": "2025-01-01", "sessions": 1, "tool_calls": 2}]
+
+        async def fake_columns(session, project_id, query, api_key, params=None, **kwargs):
+            queries.append(query)
+            return {"created": ["2025-01-01T01:00:00Z", "2025-01-01T02:00:00Z"],
+                    "root_span_id": ["s1", "s2"], "raw": ["tool", "llm"]}
+
+        with patch.object(ba, "run_sql_async", fake_sql), \
+                patch.object(ba, "run_sql_columns", fake_columns):
+            daily = asyncio.run(ba.daily_rollup(
+                None, "p", "k", "2025-01-01T00:00:00Z", "tool_calls",
+                value_sql="COUNT(*)", raw_sql="span_attributes['type']",
+                raw_value=lambda span_type: int(span_type == "tool"),
+            ))
+        return daily, queries
+
+    def test_approx_supported(self):
+        """Test APPROX_COUNT_DISTINCT is used and recorded as supported."""
+        import braintrust_analyze as ba
+        daily, queries = self.rollup(rejected=())
+        self.assertEqual(len(queries), 1)
+        self.assertIn("APPROX_COUNT_DISTINCT", queries[0])
+        self.assertIs(ba.btql_features()["approx_count_distinct"], True)
+
+    def test_approx_rejected_exact_works(self):
+        """Test a rejected approximation falls back to COUNT(DISTINCT) and is remembered."""
+        import braintrust_analyze as ba
+        daily, queries = self.rollup(rejected=("APPROX_COUNT_DISTINCT",))
+        self.assertEqual(daily, [{"day": "2025-01-01", "sessions": 1, "tool_calls": 2}])
+        self.assertIn("COUNT(DISTINCT root_span_id)", queries[1])
+        self.assertIs(ba.btql_features()["approx_count_distinct"], False)
+
+        # Persisted: a fresh process goes straight to the exact query
+        ba.btql_features.cache_clear()
+        _, queries = self.rollup(rejected=("APPROX_COUNT_DISTINCT",))
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("APPROX_COUNT_DISTINCT", queries[0])
+
+    def test_both_rejected_rolls_up_client_side(self):
+        """Test raw rows are aggregated locally and the probe stays unrecorded."""
+        import braintrust_analyze as ba
+        daily, queries = self.rollup(rejected=("COUNT(DISTINCT", "APPROX_COUNT_DISTINCT"))
+        self.assertEqual(daily, [{"day": "2025-01-01", "sessions": 2, "tool_calls": 1}])
+        self.assertEqual(len(queries), 3)
+        self.assertNotIn("approx_count_distinct", ba.btql_features())
+
+
+class TestJudgeCache(TestCase):
+    """Test the on-disk judge verdict cache."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        env = patch.dict(os.environ, {"CLAUDE_PROJECT_DIR": self.temp_dir.name})
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def test_round_trip(self):
+        """Test a stored verdict is returned for the same prompt."""
+        import braintrust_analyze as ba
+        key = ba.judge_cache_key("template {x}", "template 1")
+        self.assertIsNone(ba.judge_cache_get(key))
+        ba.judge_cache_put(key, {"verdict": "PASS", "gaps": []})
+        self.assertEqual(ba.judge_cache_get(key), {"verdict": "PASS", "gaps": []})
+        self.assertTrue(ba.judge_cache_path(key).is_relative_to(self.temp_dir.name))
+
+    def test_atomic_write_bytes(self):
+        """Test writes land whole with no tmp file left, and failures are swallowed."""
+        import braintrust_analyze as ba
+        path = Path(self.temp_dir.name) / "nested" / "entry.json"
+        ba.atomic_write_bytes(path, b"{}")
+        ba.atomic_write_bytes(path, b'{"v": 2}')
+        self.assertEqual(path.read_bytes(), b'{"v": 2}')
+        self.assertEqual(os.listdir(path.parent), ["entry.json"])
+        ba.atomic_write_bytes(path / "under-a-file", b"{}")  # OSError, ignored
+
+    def test_key_depends_on_version(self):
+        """Test bumping the cache version invalidates old entries."""
+        import braintrust_analyze as ba
+        key = ba.judge_cache_key("t", "t")
+        with patch.object(ba, "JUDGE_CACHE_VERSION", "next"):
+            self.assertNotEqual(ba.judge_cache_key("t", "t"), key)
+
+    def test_disabled(self):
+        """Test --no-cache skips both reads and writes."""
+        import braintrust_analyze as ba
+        key = ba.judge_cache_key("t", "t")
+        with patch.object(ba, "judge_cache_enabled", False):
+            ba.judge_cache_put(key, {"verdict": "PASS"})
+        self.assertIsNone(ba.judge_cache_get(key))
+
+
+class TestDeltaReview(TestCase):
+    """Test diff block splitting and delta detection for review reruns."""
+
+    def test_split_diff_blocks(self):
+        """Test each 'diff --git' header starts a new block."""
+        from braintrust_analyze import split_diff_blocks
+        diff = "diff --git a/x b/x\n+1\ndiff --git a/y b/y\n+2\n"
+        self.assertEqual(split_diff_blocks(diff), [
+            "diff --git a/x b/x\n+1\n",
+            "diff --git a/y b/y\n+2\n",
+        ])
+
+    def test_delta_start_tail_extension(self):
+        """Test appended blocks are reviewed as a delta."""
+        from braintrust_analyze import delta_start
+        previous = [f"h{i}" for i in range(8)]
+        self.assertEqual(delta_start(previous, previous + ["new"]), 8)
+
+    def test_delta_start_rejects(self):
+        """Test edits, inserts, low overlap and no-op reruns fall back to a full review."""
+        from braintrust_analyze import delta_start
+        previous = [f"h{i}" for i in range(8)]
+        self.assertIsNone(delta_start(previous, ["changed"] + previous[1:] + ["new"]))
+        self.assertIsNone(delta_start(previous, previous[:4] + ["new"] + previous[4:]))
+        self.assertIsNone(delta_start(previous, previous + ["a", "b", "c"]))
+        self.assertIsNone(delta_start(previous, previous))
+        self.assertIsNone(delta_start([], ["new"]))
+
+
+class TestGitDiff(TestCase):
+    """Test the capped, streamed review diff."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.repo = Path(self.temp_dir.name)
+
+        def git(*args):
+            subprocess.run(["git", *args], cwd=self.repo, check=True, capture_output=True)
+
+        git("init", "-q")
+        for name in ("a.txt", "b.txt"):
+            (self.repo / name).write_text("old\n")
+        git("add", ".")
+        git("-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "-m", "init")
+
+    def diff(self, max_bytes: int) -> str:
+        import braintrust_analyze as ba
+        with patch.object(ba, "MAX_DIFF_BYTES", max_bytes):
+            return asyncio.run(ba.git_diff(str(self.repo)))
+
+    def test_small_diff_untouched(self):
+        """Test a diff under the cap is returned whole with no trailer."""
+        (self.repo / "a.txt").write_text("new\n")
+        diff = self.diff(256 * 1024)
+        self.assertIn("+new", diff)
+        self.assertNotIn("diff truncated", diff)
+
+    def test_large_diff_capped_with_stat(self):
+        """Test a diff over the cap is cut and every touched file is still listed."""
+        (self.repo / "a.txt").write_text("x" * 200_000 + "\n")
+        (self.repo / "b.txt").write_text("y" * 200_000 + "\n")
+        diff = self.diff(64 * 1024)
+        self.assertLess(len(diff), 64 * 1024 + 1024)
+        self.assertIn("[diff truncated, showing --stat only]", diff)
+        stat = diff.split("[diff truncated, showing --stat only]")[1]
+        self.assertIn("a.txt", stat)
+        self.assertIn("b.txt", stat)
+
+    def test_cap_keeps_partial_chunk(self):
+        """Test the chunk crossing the cap is cut, not dropped."""
+        (self.repo / "a.txt").write_text("x" * 5_000 + "\n")
+        diff = self.diff(1024)
+        patch_bytes = diff.split("\n... [diff truncated, showing --stat only]")[0]
+        self.assertEqual(len(patch_bytes.encode()), 1024)
+        self.assertTrue(patch_bytes.startswith("diff --git"))
+
+
+class TestSemanticPlanCache(TestCase):
+    """Test the near-duplicate plan verdict cache."""
+
+    def test_embed_text_normalized(self):
+        """Test embeddings are unit length and identical text is similarity 1."""
+        from braintrust_analyze import embed_text
+        a = embed_text("Add OAuth login to the API")
+        b = embed_text("add oauth LOGIN to the api")
+        self.assertAlmostEqual(sum(v * v for v in a), 1.0)
+        self.assertAlmostEqual(sum(x * y for x, y in zip(a, b)), 1.0)
+        self.assertEqual(embed_text(""), [0.0] * len(a))
+
+    def test_lookup_threshold_outline_and_precedent(self):
+        """Test only similar plans with the same outline and precedent counts hit."""
+        from braintrust_analyze import embed_text, plan_cache_lookup, plan_cache_store
+        conn = sqlite3.connect(":memory:")
+        text = "add oauth login to the api service"
+        precedent = {"succeeded": 1, "failed": 0}
+        plan_cache_store(conn, embed_text(text), "outline", precedent, {"verdict": "PASS"})
+
+        hit = plan_cache_lookup(conn, embed_text(text), "outline", precedent)
+        self.assertEqual(hit[0], {"verdict": "PASS"})
+        self.assertIsNone(plan_cache_lookup(conn, embed_text("rewrite billing"), "outline",
+                                            precedent))
+        self.assertIsNone(plan_cache_lookup(conn, embed_text(text), "other", precedent))
+        self.assertIsNone(plan_cache_lookup(conn, embed_text(text), "outline",
+                                            {"succeeded": 2, "failed": 0}))
+        conn.close()
+
+    def test_fail_not_stored(self):
+        """Test FAIL verdicts are never kept for reuse."""
+        from braintrust_analyze import embed_text, plan_cache_lookup, plan_cache_store
+        conn = sqlite3.connect(":memory:")
+        embedding = embed_text("add oauth login")
+        plan_cache_store(conn, embedding, "outline", {}, {"verdict": "FAIL"})
+        self.assertIsNone(plan_cache_lookup(conn, embedding, "outline", {}))
+        conn.close()
+
+    def test_revised_plan_is_rejudged(self):
+        """Test a revision keeping title and overview gets a fresh verdict."""
+        import braintrust_analyze as ba
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        db = Path(temp_dir.name) / "context.db"
+        schema = Path(__file__).parent.parent / "scripts" / "artifact_schema.sql"
+        conn = sqlite3.connect(db)
+        conn.executescript(schema.read_text())
+        conn.close()
+
+        v1 = ("# Add OAuth login\n\n## Overview\nAdd OAuth login to the API service.\n\n"
+              "## Phases\n1. Add passport strategy\n2. Wire callback route\n")
+        v2 = v1 + "\n## Success Criteria\n- Login works\n\n## Dependencies\n- passport\n"
+        verdicts = iter(["FAIL", "PASS"])
+        calls = []
+
+        async def fake_judge(prompt, **format_args):
+            calls.append(format_args["plan_content"])
+            return {"verdict": next(verdicts), "gaps": [], "summary": ""}
+
+        with patch.object(ba, "llm_judge", fake_judge):
+            first = asyncio.run(ba.judge_plan_with_context(v1, str(db)))
+            second = asyncio.run(ba.judge_plan_with_context(v2, str(db)))
+            third = asyncio.run(ba.judge_plan_with_context(v2 + "- oauth\n", str(db)))
+
+        self.assertEqual((first["verdict"], second["verdict"]), ("FAIL", "PASS"))
+        self.assertNotIn("semantic_hit", second)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(third["verdict"], "PASS")
+        self.assertIn("semantic_hit", third)
+
+
+class TestPromptTemplates(TestCase):
+    """Test single-slot template splitting."""
+
+    def test_split_matches_format(self):
+        """Test joining the split halves equals str.format, braces included."""
+        from braintrust_analyze import PLAN_JUDGE_PROMPT, split_template
+        payload = "## Plan\n{not a field} }{"
+        prefix, suffix = split_template(PLAN_JUDGE_PROMPT, "content")
+        self.assertEqual(prefix + payload + suffix, PLAN_JUDGE_PROMPT.format(content=payload))
+
+    def test_split_rejects_extra_fields(self):
+        """Test a template with another field can't be registered as single-slot."""
+        from braintrust_analyze import split_template
+        with self.assertRaises((IndexError, KeyError)):
+            split_template("{a} and {b}", "a")
+
+
+class TestReducedTrace(TestCase):
+    """Test the handoff-backed reduced learn trace."""
+
+    def test_anchors_then_tasks_in_order(self):
+        """Test first/last spans are kept, tasks fill the cap, output is chronological."""
+        import braintrust_analyze as ba
+
+        spans = [{"span_id": f"s{i:02d}", "created": f"2025-01-01T00:00:{i:02d}Z",
+                  "span_type": "task" if i % 2 else "tool"} for i in range(60)]
+
+        async def fake_sql(session, project_id, query, api_key, params=None, **kwargs):
+            rows = [s for s in spans if s["span_type"] == "task" or "'tool'" in query]
+            return (rows[::-1] if "DESC" in query else rows)[:params["limit"]]
+
+        class FakeBTQLSession:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+        with patch.object(ba, "run_sql_async", fake_sql), \
+                patch.object(ba, "btql_session", FakeBTQLSession):
+            trace = asyncio.run(ba.fetch_reduced_trace("p", "k", "session"))
+
+        ids = [s["span_id"] for s in trace]
+        self.assertEqual(len(ids), ba.REDUCED_TRACE_SPANS)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(ids[:ba.REDUCED_HEAD_SPANS], ["s00", "s01", "s02", "s03", "s04"])
+        self.assertEqual(ids[-1], "s59")
+
+    def learn(self, handoff: dict | None, **fakes) -> tuple[list[str], str]:
+        """Run learn_from_session up to the LLM call; returns (posted prompts, stdout)."""
+        import braintrust_analyze as ba
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        posted = []
+
+        class RecordingSession:
+            def post(self, url, headers=None, json=None):
+                posted.append(json["messages"][0]["content"])
+                response = FakeResponse("")
+                response.status = 500
+                return response
+
+        async def fake_session():
+            return RecordingSession()
+
+        out = io.StringIO()
+        with patch.dict(os.environ, {"BRAINTRUST_API_KEY": "test",
+                                     "CLAUDE_PROJECT_DIR": temp_dir.name}), \
+                patch.object(ba, "SQL_CACHE_DIR", Path(temp_dir.name)), \
+                patch.object(ba, "get_hierarchical_context",
+                             return_value={"handoff": handoff, "ledger": None}), \
+                patch.object(ba, "_get_session", fake_session), \
+                patch.multiple(ba, **fakes), redirect_stdout(out), redirect_stderr(out):
+            ba.btql_features.cache_clear()
+            self.addCleanup(ba.btql_features.cache_clear)
+            asyncio.run(ba.learn_from_session("p", "k", "session-" + "0" * 28))
+            self.features = ba.btql_features()
+        return posted, out.getvalue()
+
+    def test_reduced_context_stays_small(self):
+        """Test a handoff-backed learn prompt stays within REDUCED_CONTEXT_CHARS."""
+        import braintrust_analyze as ba
+        handoff = {"session_name": "auth", "content": "h" * (ba.HANDOFF_SUFFICIENT_CHARS + 1)}
+        spans = [{"span_id": f"s{i:02d}", "created": f"2025-01-01T00:00:{i:02d}Z",
+                  "span_type": "tool", "span_name": "Bash", "tool_name": "Bash",
+                  "input": "i" * 20_000, "output": "o" * 20_000}
+                 for i in range(ba.REDUCED_TRACE_SPANS)]
+
+        async def fake_reduced_trace(project_id, api_key, session_id, trim=True):
+            return spans
+
+        posted, _ = self.learn(handoff, fetch_reduced_trace=fake_reduced_trace)
+        context = posted[0][len(ba._LEARN_PREFIX):len(posted[0]) - len(ba._LEARN_SUFFIX)]
+        self.assertLessEqual(len(context), ba.REDUCED_CONTEXT_CHARS + 100)
+        self.assertIn(handoff["content"], context)
+        self.assertNotIn("i" * (ba.REDUCED_FIELD_CHARS + 1), context)
+
+    def test_case_projection_rejected_falls_back(self):
+        """Test a rejected CASE projection is retried plain, not reported as no data."""
+        import braintrust_analyze as ba
+        queries = []
+
+        def fake_sql(project_id, query, api_key, params=None, raise_errors=False, **kwargs):
+            queries.append(query)
+            if "CASE WHEN" in query:
+                raise ba.BTQLError("400 - unsupported")
+            return [{"span_id": "s1", "created": "2025-01-01T00:00:00Z", "span_type": "task",
+                     "span_name": "user", "input": "fix the login bug"}]
+
+        posted, out = self.learn(None, run_sql=fake_sql)
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn("No data for session", out)
+        self.assertIn("fix the login bug", posted[0])
+        self.assertIs(self.features["learn_case_projection"], False)
+
+
+class TestJudgeSession(TestCase):
+    """Test the shared judge session's lifetime across event loops."""
+
+    def test_loop_change_closes_previous_session(self):
+        """Test a session left open by an earlier loop is closed, not leaked."""
+        import braintrust_analyze as ba
+        self.addCleanup(lambda: asyncio.run(ba._close_session()))
+
+        first = asyncio.run(ba._get_session())
+        self.assertIs(asyncio.run(ba._get_session()).closed, False)
+        self.assertTrue(first.closed)
+        self.assertIsNot(ba._JUDGE_SESSION, first)
+
+
+class TestRun(TestCase):
+    """Test the sync/async entry helper."""
+
+    def test_run_without_loop(self):
+        """Test plain sync callers get the coroutine's result."""
+        from braintrust_analyze import _run
+
+        async def answer():
+            return 42
+
+        self.assertEqual(_run(answer()), 42)
+
+    def test_run_inside_loop(self):
+        """Test callers already on a loop get an awaitable task instead of an error."""
+        from braintrust_analyze import _run
+
+        async def answer():
+            return 42
+
+        async def harness():
+            task = _run(answer())
+            self.assertIsInstance(task, asyncio.Task)
+            return await task
+
+        self.assertEqual(asyncio.run(harness()), 42)
+
+    def test_main_inside_loop(self):
+        """Test main() refuses a running loop instead of mishandling a Task."""
+        import braintrust_analyze as ba
+
+        async def harness():
+            with patch.object(ba, "parse_args") as parse_args:
+                with self.assertRaisesRegex(RuntimeError, "inside an event loop"):
+                    ba.main()
+            parse_args.assert_not_called()
+
+        asyncio.run(harness())
+
+
+class FakeResponse:
+    """Minimal aiohttp response stand-in for judge tests."""
+
+    def __init__(self, content: str):
+        self.status = 200
+        self.body = json.dumps({"choices": [{"message": {"content": content}}]})
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def text(self):
+        return self.body
+
+    async def read(self):
+        return self.body.encode()
+
+
+class FakeSession:
+    def __init__(self, content: str):
+        self.content = content
+
+    def post(self, *args, **kwargs):
+        return FakeResponse(self.content)
+
+
+class TestJudgeParsing(TestCase):
+    """Test verdict extraction from judge responses."""
+
+    def judge(self, content: str) -> dict:
+        import braintrust_analyze as ba
+
+        async def fake_session():
+            return FakeSession(content)
+
+        with patch.dict(os.environ, {"BRAINTRUST_API_KEY": "test"}), \
+                patch.object(ba, "_get_session", fake_session), \
+                patch.object(ba, "judge_cache_enabled", False):
+            return asyncio.run(ba.llm_judge("{x}", x="plan"))
+
+    def test_fenced_json_with_trailing_prose(self):
+        """Test fenced JSON is extracted even with text around it."""
+        result = self.judge('Here you go:\n```json\n{"verdict": "PASS", "gaps": []}\n```\nDone.')
+        self.assertEqual(result["verdict"], "PASS")
+
+    def test_braces_inside_strings(self):
+        """Test a closing brace inside a string doesn't end the object early."""
+        result = self.judge(
+            '{"verdict": "FAIL", "summary": "missing } handler", "gaps": [{"id": 1}]} extra'
+        )
+        self.assertEqual(result["verdict"], "FAIL")
+        self.assertEqual(result["summary"], "missing } handler")
+        self.assertEqual(result["gaps"], [{"id": 1}])
+
+    def test_unparseable(self):
+        """Test non-JSON responses surface an error instead of raising."""
+        result = self.judge("no json here")
+        self.assertIsNone(result["verdict"])
+        self.assertIn("Could not parse", result["error"])
+
+
+if __name__ == "__main__":
+    main()